@@ -4,15 +4,40 @@ from modules import (
     combgc_barplot_ui, combgc_barplot_server, 
     combgc_taxonomy_ui, combgc_taxonomy_server,
     taxonomy_stacked_bar_ui, taxonomy_stacked_bar_server,
-    filter_data
+    region_query_ui, region_query_server,
+    diagnostics_ui, diagnostics_server,
+    filter_counts, filter_state, tool_mask, product_class_mask, length_mask
     )
-from plots import preprocess_taxonomy_column
-from shiny import App, Inputs, Outputs, Session, reactive, ui, render
+from background import BackgroundTask
+from dataset import default_registry, load_files, merged_dataset
+from instrumentation import instrumentation, rows_of, timed
+from loader import ARCHIVE_SUFFIXES, TABLE_SUFFIXES
+from table_engine import RowView
+from shiny import App, Inputs, Outputs, Session, reactive, req, ui, render
 
+import asyncio
+import time
+import numpy as np
 import shinyswatch
 from pathlib import Path
 import pandas as pd
 
+# Pause after the last sidebar filter change before the filters are applied to the data
+FILTER_DEBOUNCE_SECONDS = 0.6
+
+# Datasets shared by all sessions, loaded once per process
+registry = default_registry()
+if registry is not None:
+    registry.preload()
+
+def dataset_picker():
+    if registry is None or not registry.names():
+        return []
+    return [
+        ui.p("Choose a shared dataset or upload a file:"),
+        ui.input_select("dataset_choice", "", choices={"": "Uploaded file", **{name: name for name in registry.names()}}),
+    ]
+
 #################
 # UI: user interface function
 #################
@@ -23,14 +48,18 @@ app_ui = ui.page_navbar(
     combgc_barplot_ui("tab3"), 
     taxonomy_stacked_bar_ui("tab4"),
     combgc_taxonomy_ui("tab5"), 
+    region_query_ui("tab6"),
+    # Timings of the reactive graph, only with COMBGC_INSTRUMENT set
+    *([diagnostics_ui("diagnostics")] if instrumentation is not None else []),
     # Sidebar
     sidebar=ui.sidebar(
         # Add logo
         ui.img(src="com-bgc-logo.png", style="width:200px;"),
         ui.a(dict(href="https://github.com/tomrichtermeier/COMbgc-Interface"), "COMbgc documentation"),
-        # Upload file in TSV format
-        ui.p("Choose a file to upload:"),
-        ui.input_file("combgc_user_tsv", label="", accept=[".tsv"]),
+        # Pick a shared dataset (when configured) or upload file in TSV format
+        *dataset_picker(),
+        ui.p("Choose files or archives to upload:"),
+        ui.input_file("combgc_user_tsv", label="", multiple=True, accept=[*TABLE_SUFFIXES, *ARCHIVE_SUFFIXES]),
         
         ui.p(),
         ui.HTML("<h4 style='color: #595959; font-size: 18px; font-weight: bold; margin-bottom: -5px;'>Select Prediction Tool</h4>"),
@@ -41,6 +70,11 @@ app_ui = ui.page_navbar(
             selected=["deepBGC", "GECCO", "antiSMASH"],
         ),
 
+        ui.p(),
+        ui.HTML("<h4 style='color: #595959; font-size: 18px; font-weight: bold; margin-bottom: -5px;'>Merge Overlapping BGCs</h4>"),
+        ui.input_checkbox("remerge", "Recompute merging", value=False),
+        ui.input_slider("merge_overlap_fraction", "Minimum overlap (fraction of the shorter BGC):", min=0, max=1, value=0, step=0.05),
+
         ui.p(),  
         ui.HTML("<h4 style='color: #595959; font-size: 18px; font-weight: bold; margin-bottom: -5px;'>Filter by BGC Length</h4>"),
         ui.row(
@@ -57,10 +91,18 @@ app_ui = ui.page_navbar(
                 step=1,
             ))
         ),
+        ui.output_text("length_window_info"),
         
         # Output UI for product classes
         ui.output_ui("product_class_ui"),
         ui.p(""),
+        # Filters are applied after a pause in the changes, or with the button in manual mode
+        ui.input_checkbox("manual_apply", "Apply filters with the button", value=False),
+        ui.panel_conditional(
+            "input.manual_apply",
+            ui.input_action_button("apply_filters", "Apply filters", class_="btn btn-info"),
+        ),
+        ui.output_text("filter_status"),
         width="300px"
     ),
     title="COMbgc",
@@ -68,28 +110,62 @@ app_ui = ui.page_navbar(
 )
 
 def server(input: Inputs, output: Outputs, session: Session):
+    @reactive.extended_task
+    async def parse_upload(files):
+        # Parse in a worker thread outside the reactive lock, so this and other sessions stay responsive
+        loop = asyncio.get_running_loop()
+        with ui.Progress(min=0, max=1) as progress:
+            progress.set(0, message="Reading uploaded files...")
+
+            def report(done, total, name):
+                loop.call_soon_threadsafe(lambda: progress.set(done / total, message=f"Read {done} of {total} tables", detail=name))
+
+            return await loop.run_in_executor(None, lambda: load_files(files, progress=report))
+
+    @reactive.Effect
+    @reactive.event(input.combgc_user_tsv)
+    def load_upload():
+        # A new upload supersedes one that is still being parsed
+        files = [(file_info['name'], file_info['datapath']) for file_info in input.combgc_user_tsv()]
+        parse_upload.cancel()
+        parse_upload.invoke(files)
+
+    # Shared datasets are looked up in the render pool, so a first load does not block the event loop
+    shared_dataset = BackgroundTask(registry.get) if registry is not None else None
+
     @reactive.Calc()
-    def data():
-        file_infos = input.combgc_user_tsv()
-        if not file_infos:
+    @timed("loaded_data")
+    def loaded_data():
+        if registry is not None and "dataset_choice" in input and input.dataset_choice():
+            name = input.dataset_choice()
+            return shared_dataset.result(name, lambda: (name,))
+        if parse_upload.status() == "initial":
             return None
-        file_info = file_infos[0]
-        df = pd.read_csv(file_info['datapath'], sep='\t')
-        df["mmseqs_lineage_contig"] = df["mmseqs_lineage_contig"].astype(str).fillna("")
-        if 'identifier' in df.columns:
-            df = df.drop(columns="identifier")
-        return df
+        return parse_upload.result()
+
+    remerged = BackgroundTask(merged_dataset)
+
+    @reactive.Calc()
+    @timed("data")
+    def data():
+        # Optionally replace the merging shipped with the table by the user's overlap rule, merged in the render pool
+        dataset = loaded_data()
+        if dataset is None or not input.remerge():
+            return dataset
+        min_overlap_fraction = input.merge_overlap_fraction()
+        return remerged.result((dataset.fingerprint, min_overlap_fraction), lambda: (dataset, min_overlap_fraction))
 
     @reactive.Calc()
     def product_classes():
-        df = data()
-        if df is None or df.empty:
+        dataset = data()
+        if dataset is None or len(dataset) == 0:
             return []
         else:
-            return sorted({item for entry in df["Product_class"].dropna() for item in entry.split(", ")})
+            return dataset.product_classes.vocabulary
 
     @output
     @render.ui
+    @timed("product_class_ui")
     def product_class_ui():
         classes = product_classes()
         if not classes:
@@ -106,24 +182,90 @@ def server(input: Inputs, output: Outputs, session: Session):
         )
 
     @reactive.Calc()
-    def filtered_data() -> pd.DataFrame:
-        df = data()
-        if df is None:
-            return None
-        
+    def sidebar_filters():
+        # Filters as currently entered in the sidebar, before they are applied
         selected_tools = input.tool_selection() or []
         deepBGC_selected = "deepBGC" in selected_tools
         GECCO_selected = "GECCO" in selected_tools
         antiSMASH_selected = "antiSMASH" in selected_tools
         all_selected = "Shared by All" in selected_tools
+        tools = (deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected)
+        lengths = (input.bgc_length_min() or 0, input.bgc_length_max() or float("inf"))
+        return tools, tuple(input.product_class() or []), lengths
+
+    # Filters applied to the data, one value per criterion; a value is only set when it changed, so a
+    # burst of changes to one criterion recomputes its mask once and leaves the other masks cached
+    applied_tools = reactive.Value(None)
+    applied_product_classes = reactive.Value(None)
+    applied_lengths = reactive.Value(None)
+    changed_at = reactive.Value(None)
+
+    def apply_filters():
+        with reactive.isolate():
+            tools, product_classes, lengths = sidebar_filters()
+            for applied, value in [(applied_tools, tools), (applied_product_classes, product_classes), (applied_lengths, lengths)]:
+                if applied.get() != value:
+                    applied.set(value)
+            changed_at.set(None)
+
+    @reactive.Effect
+    def on_filter_change():
+        sidebar_filters()
+        with reactive.isolate():
+            if applied_tools.get() is None:
+                apply_filters()  # The initial filters are applied at once
+            else:
+                changed_at.set(time.monotonic())
+
+    @reactive.Effect
+    def debounce_filters():
+        # Apply the filters once they were left alone for FILTER_DEBOUNCE_SECONDS, unless in manual mode
+        changed = changed_at.get()
+        if changed is None or input.manual_apply():
+            return
+        remaining = changed + FILTER_DEBOUNCE_SECONDS - time.monotonic()
+        if remaining > 0:
+            reactive.invalidate_later(remaining)
+        else:
+            apply_filters()
+
+    @reactive.Effect
+    @reactive.event(input.apply_filters)
+    def on_apply_filters():
+        apply_filters()
+
+    @output
+    @render.text
+    def filter_status():
+        if changed_at.get() is not None and input.manual_apply():
+            return "Filter changes not applied yet."
+        return ""
 
-        selected_product_classes = input.product_class() or []
-        bgc_length_min = input.bgc_length_min() or 0
-        bgc_length_max = input.bgc_length_max() or float("inf")
+    @reactive.Calc()
+    def tool_arguments():
+        tools = applied_tools.get()
+        req(tools is not None)
+        return tools
+
+    @reactive.Calc()
+    def length_window():
+        lengths = applied_lengths.get()
+        req(lengths is not None)
+        return lengths
+
+    @reactive.Calc()
+    def product_class_arguments():
+        product_classes = applied_product_classes.get()
+        req(product_classes is not None)
+        return list(product_classes)
+
+    @reactive.Calc()
+    def filter_arguments():
+        deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected = tool_arguments()
+        selected_product_classes = product_class_arguments()
+        bgc_length_min, bgc_length_max = length_window()
 
-        # Apply the filter_data function to filter based on sidebar inputs
-        df_filtered = filter_data(
-            df, 
+        return (
             deepBGC_selected, 
             GECCO_selected, 
             antiSMASH_selected, 
@@ -132,7 +274,78 @@ def server(input: Inputs, output: Outputs, session: Session):
             bgc_length_min, 
             bgc_length_max
         )
-        return df_filtered
+
+    # Each filter criterion has its own cached mask, so changing one input only recomputes its mask
+    @reactive.Calc()
+    @timed("selected_tool_mask", rows=rows_of(data))
+    def selected_tool_mask():
+        dataset = data()
+        if dataset is None:
+            return None
+        return tool_mask(dataset, *tool_arguments())
+
+    @reactive.Calc()
+    @timed("selected_product_class_mask", rows=rows_of(data))
+    def selected_product_class_mask():
+        dataset = data()
+        if dataset is None:
+            return None
+        return product_class_mask(dataset, product_class_arguments())
+
+    @reactive.Calc()
+    @timed("selected_length_mask", rows=rows_of(data))
+    def selected_length_mask():
+        dataset = data()
+        if dataset is None:
+            return None
+        return length_mask(dataset, *length_window())
+
+    @output
+    @render.text
+    def length_window_info():
+        """
+        Number of BGCs in the length window as entered, read from the length index without scanning the table
+        """
+        dataset = data()
+        if dataset is None:
+            return ""
+        _, _, lengths = sidebar_filters()
+        return f"{dataset.lengths.count(*lengths)} of {len(dataset)} BGCs in this length window"
+
+    @reactive.Calc()
+    @timed("filtered_view", rows=rows_of(data))
+    def filtered_view() -> RowView:
+        dataset = data()
+        if dataset is None:
+            return None
+        rows = np.flatnonzero(selected_tool_mask() & selected_product_class_mask() & selected_length_mask())
+        return RowView(dataset.table, rows)
+
+    @reactive.Calc()
+    @timed("filtered_data")
+    def filtered_data() -> pd.DataFrame:
+        view = filtered_view()
+        if view is None:
+            return None
+        return view.frame()
+
+    @reactive.Calc()
+    @timed("figure_state")
+    def figure_state():
+        dataset = data()
+        if dataset is None:
+            return None
+        # Key of the figures built from the filtered data in the process-wide figure cache
+        return filter_state(dataset, *filter_arguments())
+
+    @reactive.Calc()
+    @timed("filtered_counts", rows=rows_of(data))
+    def filtered_counts() -> pd.DataFrame:
+        dataset = data()
+        if dataset is None:
+            return None
+        # Same filters as a slice of the count cube, for the count-based plots
+        return filter_counts(dataset, *filter_arguments())
 
     @reactive.Effect
     @reactive.event(input.tool_selection)
@@ -156,11 +369,14 @@ def server(input: Inputs, output: Outputs, session: Session):
         session.send_input_message("product_class", {"value": new_selection})
 
     # Use filtered_data in your module servers
-    combgc_table_server(id="tab1", df=filtered_data)
-    combgc_general_statistics_server(id="tab2", df=filtered_data)
-    combgc_barplot_server(id="tab3", df=filtered_data)
-    taxonomy_stacked_bar_server(id="tab4", df=filtered_data)
-    combgc_taxonomy_server(id="tab5", df=filtered_data)
+    combgc_table_server(id="tab1", df=filtered_view)
+    combgc_general_statistics_server(id="tab2", df=filtered_data, counts=filtered_counts, view=filtered_view, state=figure_state)
+    combgc_barplot_server(id="tab3", df=filtered_data, counts=filtered_counts, view=filtered_view, state=figure_state)
+    taxonomy_stacked_bar_server(id="tab4", df=filtered_data, counts=filtered_counts, state=figure_state)
+    combgc_taxonomy_server(id="tab5", df=filtered_data, state=figure_state)
+    region_query_server(id="tab6", dataset=data, view=filtered_view)
+    if instrumentation is not None:
+        diagnostics_server(id="diagnostics")
 
 # Add path to logo
 www_dir = Path(__file__).parent / ""  # Change path to the directory where images should be found
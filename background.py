@@ -0,0 +1,124 @@
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from shiny import reactive
+from shiny.session import get_current_session
+
+###########################################
+#      BACKGROUND BUILDS
+###########################################
+# Worker threads for the figure and aggregation builds of all sessions, configurable through the environment
+RENDER_WORKERS = int(os.environ.get("COMBGC_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+
+render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="combgc-render")
+
+# Builds of one session in the render pool at a time; further ones wait, and are dropped there when superseded
+SESSION_RENDER_JOBS = int(os.environ.get("COMBGC_SESSION_RENDER_JOBS", 2))
+
+_session_slots = weakref.WeakKeyDictionary()
+_current = threading.local()
+
+
+class BuildCancelled(Exception):
+    """
+    Raised at a checkpoint of a build whose run has been superseded.
+    """
+
+
+class CancelToken:
+    """
+    Cancellation flag of one background run, set from the event loop and checked by the build in the pool.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self):
+        if self._event.is_set():
+            raise BuildCancelled()
+
+
+def checkpoint():
+    """
+    Stop the build running in this thread when its run has been cancelled, e.g. between data preparation,
+    trace building and layout. Outside a background run this does nothing.
+    """
+    token = getattr(_current, "token", None)
+    if token is not None:
+        token.check()
+
+
+def _run_with_token(token, func, *args):
+    token.check()  # superseded while queued in the pool
+    _current.token = token
+    try:
+        return func(*args)
+    finally:
+        _current.token = None
+
+
+async def run_in_background(func, *args, token=None, slots=None):
+    """
+    Run `func(*args)` in the render pool. Cancelling the awaiting task drops a call that has not started yet;
+    a started call stops at its next checkpoint once `token` is cancelled. With `slots` (see session_slots)
+    the call waits for a slot before it is submitted and holds it until it has left the pool.
+    """
+    token = token if token is not None else CancelToken()
+    if slots is not None:
+        await slots.acquire()
+    future = render_pool.submit(_run_with_token, token, func, *args)
+    if slots is not None:
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+    return await asyncio.wrap_future(future)
+
+
+def session_slots(session):
+    """
+    Semaphore limiting the builds `session` has in the render pool to SESSION_RENDER_JOBS.
+    """
+    if session is None:
+        return asyncio.Semaphore(SESSION_RENDER_JOBS)
+    session = session.root_scope()
+    if session not in _session_slots:
+        _session_slots[session] = asyncio.Semaphore(SESSION_RENDER_JOBS)
+    return _session_slots[session]
+
+
+class BackgroundTask:
+    """
+    The result of `func` for the latest arguments, computed in the render pool by an ExtendedTask, i.e.
+    outside the reactive lock, so the event loop keeps serving other sessions (and the other outputs of
+    this one) while it runs. Call `result` from a render function or calc: a changed `key` starts a new
+    run and cancels the superseded one. A superseded run that is still waiting for one of the session's
+    SESSION_RENDER_JOBS slots never takes a worker; one already in the pool keeps its worker until it
+    reaches a checkpoint (or finishes), and its result never reaches the caller. While a run is in
+    progress the caller is stopped with the progress state of its outputs.
+    """
+    def __init__(self, func):
+        self._func = func
+        self._key = None
+        self._token = CancelToken()
+        self._slots = session_slots(get_current_session())
+        self._task = reactive.ExtendedTask(self._run)
+
+    async def _run(self, token, *args):
+        return await run_in_background(self._func, *args, token=token, slots=self._slots)
+
+    def result(self, key, arguments):
+        """
+        `func(*arguments())` for this `key`; `arguments` may read reactive sources and is only called to start a run.
+        """
+        if key != self._key:
+            args = arguments()
+            self._key = key
+            self._token.cancel()
+            self._token = CancelToken()
+            self._task.cancel()
+            self._task.invoke(self._token, *args)
+        return self._task.result()
@@ -0,0 +1,199 @@
+"""
+Scaling benchmarks of the data and plotting functions on synthetic comBGC tables (see synthetic.py).
+
+    python benchmark.py --rows 10000 100000 1000000 --repeat 3
+
+Reports wall time, peak traced memory and figure payload size per function and table size, and
+appends the results to a JSONL history that later runs are compared against.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dataset import ComBGCDataset
+from loader import TAXONOMY_LEVELS
+from merging import merge_bgcs
+from modules import filter_counts, filter_data
+from plots import (
+    boxplot_product_classes,
+    create_venn,
+    create_venn_from_counts,
+    plot_combgc_sankey,
+    preprocess_taxonomy_column,
+    scatter_bgc_contig_classes,
+    stacked_bars_product_classes,
+    stacked_bars_product_classes_from_counts,
+    stacked_bars_taxonomy,
+    stacked_bars_taxonomy_from_counts,
+)
+from synthetic import TableProfile, synthesize_table
+
+###########################################
+#      BENCHMARKS
+###########################################
+# Default history of benchmark results, one JSON object per function and table size
+HISTORY_PATH = Path(__file__).parent / "benchmark_history.jsonl"
+
+# Sidebar filters of a new session: all tools, all product classes, the default length window
+DEFAULT_FILTERS = (True, True, True, False, [], 3000, 1000000)
+
+
+class BenchmarkData:
+    """
+    A synthetic table with the inputs the benchmarked functions take, prepared outside the timings.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.dataset = ComBGCDataset(table)
+        self.filtered = filter_data(self.dataset, *DEFAULT_FILTERS)
+        self.counts = filter_counts(self.dataset, *DEFAULT_FILTERS)
+        self.unparsed = table.drop(columns=TAXONOMY_LEVELS)
+
+
+# Benchmarked functions by name, each called with a BenchmarkData
+BENCHMARKS = {
+    "load_indexes": lambda data: ComBGCDataset(data.table),
+    "filter_data": lambda data: filter_data(data.dataset, *DEFAULT_FILTERS),
+    "filter_counts": lambda data: filter_counts(data.dataset, *DEFAULT_FILTERS),
+    "preprocess_taxonomy_column": lambda data: preprocess_taxonomy_column(data.unparsed),
+    "create_venn": lambda data: create_venn(data.filtered),
+    "create_venn_from_counts": lambda data: create_venn_from_counts(data.counts),
+    "boxplot_product_classes": lambda data: boxplot_product_classes(data.filtered, 1),
+    "scatter_bgc_contig_classes": lambda data: scatter_bgc_contig_classes(data.filtered, 15),
+    "stacked_bars_product_classes": lambda data: stacked_bars_product_classes(data.filtered),
+    "stacked_bars_product_classes_from_counts": lambda data: stacked_bars_product_classes_from_counts(data.counts),
+    "stacked_bars_taxonomy": lambda data: stacked_bars_taxonomy(data.filtered, "Species"),
+    "stacked_bars_taxonomy_from_counts": lambda data: stacked_bars_taxonomy_from_counts(preprocess_taxonomy_column(data.counts), "Species"),
+    "plot_combgc_sankey": lambda data: plot_combgc_sankey(data.filtered),
+    "merge_bgcs": lambda data: merge_bgcs(data.table, intervals=data.dataset.intervals),
+    "overlap_join": lambda data: data.dataset.intervals.overlap_join(),
+}
+
+
+def measure(func, data, repeat):
+    """
+    Wall times of `repeat` calls, then the peak traced memory and the figure payload (bytes of the
+    JSON sent to the browser, None for non-figures) of one more call under tracemalloc.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = func(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    payload = len(result.to_json()) if hasattr(result, "to_plotly_json") else None
+    return {
+        "wall_median_s": statistics.median(times),
+        "wall_min_s": min(times),
+        "peak_bytes": peak,
+        "payload_bytes": payload,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    """
+    Latest previous result per history_key, to compare a run against.
+    """
+    latest = {}
+    if Path(path).exists():
+        with open(path) as handle:
+            for line in handle:
+                entry = json.loads(line)
+                latest[history_key(entry)] = entry
+    return latest
+
+
+def history_key(result):
+    """
+    Results with the same key were measured on the same synthetic table.
+    """
+    return result["function"], result["rows"], result["seed"], result.get("lineage_variants", 1), result.get("bgcs_per_contig")
+
+
+def run_benchmarks(rows, names=None, repeat=3, seed=0, lineage_variants=1, bgcs_per_contig=None, label=None):
+    """
+    Benchmark the functions `names` (default all of BENCHMARKS) on synthetic tables of each size in `rows`.
+    Yields one result dict per function and size.
+    """
+    profile = TableProfile()
+    commit = current_commit()
+    for n in rows:
+        start = time.perf_counter()
+        table = synthesize_table(n, seed=seed, profile=profile, bgcs_per_contig=bgcs_per_contig, lineage_variants=lineage_variants)
+        generated = time.perf_counter() - start
+        data = BenchmarkData(table)
+        for name in names or BENCHMARKS:
+            yield {
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": commit,
+                "label": label,
+                "function": name,
+                "rows": n,
+                "seed": seed,
+                "lineage_variants": lineage_variants,
+                "bgcs_per_contig": bgcs_per_contig,
+                "repeat": repeat,
+                "generate_s": generated,
+                **measure(BENCHMARKS[name], data, repeat),
+            }
+
+
+def format_result(result, previous=None):
+    payload = "-" if result["payload_bytes"] is None else f"{result['payload_bytes'] / 1024:.1f}"
+    change = ""
+    if previous is not None and previous["wall_median_s"] > 0:
+        change = f"{(result['wall_median_s'] / previous['wall_median_s'] - 1) * 100:+.0f}% vs {previous.get('commit') or previous['timestamp']}"
+    return (
+        f"{result['function']:<42} {result['rows']:>10} {result['wall_median_s']:>10.4f} "
+        f"{result['peak_bytes'] / 1024 ** 2:>10.1f} {payload:>12}  {change}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000], help="table sizes (BGCs)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="functions to benchmark (default all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per function")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lineage-variants", type=int, default=1, help="variants per lineage, for high-cardinality taxonomy levels")
+    parser.add_argument("--bgcs-per-contig", type=float, default=None, help="average BGCs per contig (default as in the fixture)")
+    parser.add_argument("--label", default=None, help="free-text label stored with the results")
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSONL file the results are appended to")
+    parser.add_argument("--no-history", action="store_true", help="do not append the results to the history")
+    args = parser.parse_args()
+
+    previous = read_history(args.history)
+    print(f"{'function':<42} {'rows':>10} {'median s':>10} {'peak MiB':>10} {'payload KiB':>12}")
+    results = run_benchmarks(
+        args.rows, names=args.only, repeat=args.repeat, seed=args.seed,
+        lineage_variants=args.lineage_variants, bgcs_per_contig=args.bgcs_per_contig, label=args.label,
+    )
+    for result in results:
+        print(format_result(result, previous.get(history_key(result))), flush=True)
+        if not args.no_history:
+            with open(args.history, "a") as handle:
+                handle.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
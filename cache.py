@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from loader import has_pyarrow
+
+###########################################
+#      PARQUET CACHE
+###########################################
+# Bump when the loader output changes, so stale cache entries are no longer found
+CACHE_VERSION = "3"
+
+# Cache location and size limit, configurable through the environment; an empty COMBGC_CACHE_DIR disables the cache
+CACHE_DIR = os.environ.get("COMBGC_CACHE_DIR", str(Path.home() / ".cache" / "combgc"))
+CACHE_MAX_BYTES = int(os.environ.get("COMBGC_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+_HASH_BLOCK_BYTES = 1024 ** 2
+
+logger = logging.getLogger(__name__)
+_write_failure_logged = False
+
+
+def _cache_errors():
+    """
+    Exceptions of reading or writing a cache entry: file system errors and pyarrow's read and conversion errors.
+    """
+    import pyarrow as pa
+    return (OSError, pa.ArrowException)
+
+
+def content_hash(path):
+    """
+    SHA-256 of the file contents, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TableCache:
+    """
+    Content-addressed on-disk cache of typed comBGC tables stored as Parquet.
+    Entries are evicted least recently used first once the cache grows beyond `max_bytes`.
+    """
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        return self.directory / f"{key}-v{CACHE_VERSION}.parquet"
+
+    def get(self, key):
+        """
+        The table cached under `key`, or None. An unreadable or corrupt entry is removed and counts as a miss.
+        """
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # e.g. a read-only cache, entries are then evicted by age of writing
+        try:
+            return pd.read_parquet(path, memory_map=True)
+        except _cache_errors() as error:
+            logger.warning("Ignoring unreadable cache entry %s: %s", path, error)
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return None
+
+    def put(self, key, table):
+        """
+        Cache `table` under `key`. A failed write (disk full, read-only directory, a column Parquet cannot
+        store) leaves the cache as it was and is logged once per process; returns whether the table was cached.
+        """
+        global _write_failure_logged
+        temporary = None
+        try:
+            # Write to a temporary file first so concurrent sessions never read a partial entry
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(handle)
+            table.to_parquet(temporary)
+            os.replace(temporary, self.path(key))
+            self.evict()
+        except _cache_errors() as error:
+            if not _write_failure_logged:
+                logger.warning("Tables are not cached in %s: %s", self.directory, error)
+                _write_failure_logged = True
+            return False
+        finally:
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+        return True
+
+    def evict(self):
+        entries = sorted(self.directory.glob("*.parquet"), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            entry.unlink(missing_ok=True)
+
+    def load(self, path, read, key=None):
+        """
+        The cached table for the file at `path`, calling `read(path)` and caching the result on a miss.
+        `key` is the content hash of the file, when already known. The table is returned even if caching it fails.
+        """
+        key = key or content_hash(path)
+        table = self.get(key)
+        if table is None:
+            table = read(path)
+            self.put(key, table)
+        return table
+
+
+def default_cache():
+    """
+    The cache configured through the environment, or None when disabled or pyarrow is not installed.
+    """
+    if not CACHE_DIR or not has_pyarrow():
+        return None
+    try:
+        return TableCache(CACHE_DIR)
+    except OSError:
+        return None
@@ -0,0 +1,321 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from background import checkpoint
+from cache import content_hash, default_cache
+from intervals import ContigIntervalIndex
+from merging import merge_bgcs
+from loader import TABLE_SUFFIXES, read_combgc_table, read_combgc_tables, tool_codes
+
+
+###########################################
+#      DATASET
+###########################################
+class ComBGCDataset:
+    """
+    A typed comBGC table together with the indexes built once at load.
+    The table index holds the row positions, so filtered frames can be mapped back onto the indexes.
+    `fingerprint` identifies the table contents, e.g. for caching results computed from it.
+    """
+    def __init__(self, table, fingerprint=None):
+        self.table = table
+        self.fingerprint = fingerprint or table_fingerprint(table)
+        self.product_classes = ProductClassIndex(table["Product_class"])
+        self.lengths = LengthIndex(table["BGC_length"])
+        self.intervals = ContigIntervalIndex(table)
+        self.counts = CountCube(table, self.lengths)
+
+    def __len__(self):
+        return len(self.table)
+
+
+def table_fingerprint(table):
+    """
+    SHA-256 over the column names and the row hashes of a table, for tables not read from a file.
+    """
+    digest = hashlib.sha256("\0".join(table.columns).encode())
+    digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def merged_dataset(dataset, min_overlap_fraction):
+    """
+    The dataset with its overlapping BGCs re-clustered under the given minimum overlap (see merge_bgcs).
+    """
+    table = merge_bgcs(dataset.table, min_overlap_fraction, intervals=dataset.intervals)
+    checkpoint()
+    return ComBGCDataset(table, fingerprint=f"{dataset.fingerprint}-merged-{min_overlap_fraction:g}")
+
+
+def load_dataset(source, engine=None, use_cache=True, name=None):
+    """
+    Read a comBGC table and build its indexes. Files are looked up in the Parquet cache by content
+    hash first, so repeated uploads of the same table skip the TSV parse.
+    """
+    def read(path):
+        return read_combgc_table(path, engine=engine, name=name)
+
+    if not isinstance(source, (str, os.PathLike)):
+        return ComBGCDataset(read(source))
+    key = content_hash(source)
+    cache = default_cache() if use_cache else None
+    if cache is not None:
+        return ComBGCDataset(cache.load(source, read, key=key), fingerprint=key)
+    return ComBGCDataset(read(source), fingerprint=key)
+
+
+def load_files(files, engine=None, use_cache=True, progress=None):
+    """
+    Read uploaded comBGC tables and archives, given as (name, path) pairs, into one dataset.
+    A single table is loaded as is; several tables are parsed in parallel and combined with a
+    `source_file` column. The combined table is cached under the names and contents of all files.
+    """
+    if len(files) == 1 and files[0][0].lower().endswith(TABLE_SUFFIXES):
+        dataset = load_dataset(files[0][1], engine=engine, use_cache=use_cache, name=files[0][0])
+        if progress is not None:
+            progress(1, 1, files[0][0])
+        return dataset
+
+    def read():
+        return read_combgc_tables(files, engine=engine, progress=progress)
+
+    digest = hashlib.sha256()
+    for name, path in files:
+        digest.update(f"{name}\0{content_hash(path)}\0".encode())
+    key = digest.hexdigest()
+    cache = default_cache() if use_cache else None
+    if cache is None:
+        return ComBGCDataset(read(), fingerprint=key)
+    table = cache.get(key)
+    if table is None:
+        table = read()
+        cache.put(key, table)
+    return ComBGCDataset(table, fingerprint=key)
+
+
+###########################################
+#      SHARED DATASETS
+###########################################
+# Directory scanned at startup for comBGC tables shared by all sessions; unset disables the dataset picker
+DATA_DIR = os.environ.get("COMBGC_DATA_DIR", "")
+
+# File patterns of the comBGC tables picked up from DATA_DIR
+DATA_PATTERNS = [f"*{suffix}" for suffix in TABLE_SUFFIXES]
+
+
+class DatasetRegistry:
+    """
+    Datasets found in a server directory, each loaded at most once per process and shared
+    read-only by all sessions. Tables are read through the Parquet cache, so they are memory-mapped
+    when it is enabled. Datasets load independently: a caller only waits for the one it asks for.
+    """
+    def __init__(self, directory):
+        directory = Path(directory)
+        paths = sorted(path for pattern in DATA_PATTERNS for path in directory.glob(pattern))
+        self.paths = {path.name: path for path in paths}
+        self._datasets = {}  # Future of each dataset that is loaded or being loaded
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self.paths)
+
+    def get(self, name):
+        """
+        The dataset `name`, loaded by the first caller; blocks until it is loaded. A failed load is
+        raised to all waiting callers and retried by the next one.
+        """
+        with self._lock:
+            future = self._datasets.get(name)
+            loading = future is None
+            if loading:
+                future = self._datasets[name] = Future()
+        if loading:
+            try:
+                future.set_result(load_dataset(self.paths[name]))
+            except Exception as error:
+                with self._lock:
+                    del self._datasets[name]
+                future.set_exception(error)
+        return future.result()
+
+    def preload(self):
+        """
+        Load all datasets in a background thread, so the first session does not wait for the parse.
+        """
+        def load_all():
+            for name in self.names():
+                try:
+                    self.get(name)
+                except Exception:
+                    continue  # Raised again to the session that picks the dataset
+
+        threading.Thread(target=load_all, name="combgc-preload", daemon=True).start()
+
+
+def default_registry():
+    """
+    The registry of DATA_DIR, or None when no data directory is configured.
+    """
+    if not DATA_DIR or not Path(DATA_DIR).is_dir():
+        return None
+    return DatasetRegistry(DATA_DIR)
+
+
+###########################################
+#      PRODUCT CLASS INDEX
+###########################################
+class ProductClassIndex:
+    """
+    Multi-hot index of the comma-separated Product_class column.
+    `matrix` is a boolean (Product_class value x class) matrix over `vocabulary`. Rows point into it
+    through the categorical codes, so the split is done once per distinct value, not once per row.
+    """
+    def __init__(self, product_class):
+        product_class = product_class.astype("category")
+        values = product_class.cat.categories
+        classes = [value.split(", ") for value in values]
+
+        self.vocabulary = sorted({item for items in classes for item in items})
+        self._positions = {item: i for i, item in enumerate(self.vocabulary)}
+        self.matrix = np.zeros((len(values), len(self.vocabulary)), dtype=bool)
+        for row, items in enumerate(classes):
+            self.matrix[row, [self._positions[item] for item in items]] = True
+        self.codes = product_class.cat.codes.to_numpy()
+
+    def value_mask(self, selected_product_classes):
+        """
+        Boolean mask of the Product_class values (categories) that contain any of the selected classes,
+        with an extra trailing False that code -1 (missing Product_class) picks.
+        """
+        columns = [self._positions[item] for item in selected_product_classes if item in self._positions]
+        return np.append(self.matrix[:, columns].any(axis=1), False)
+
+    def mask(self, selected_product_classes):
+        """
+        Boolean row mask of the BGCs that belong to any of the selected classes.
+        """
+        return self.value_mask(selected_product_classes)[self.codes]
+
+
+###########################################
+#      LENGTH INDEX
+###########################################
+class LengthIndex:
+    """
+    BGC_length sorted once at load, so a length window is answered with two binary searches.
+    `order` holds the row positions sorted by length; BGCs without a length are left out.
+    """
+    def __init__(self, bgc_length):
+        lengths = bgc_length.to_numpy(dtype=float, na_value=np.nan)
+        self.size = len(lengths)
+        rows = np.flatnonzero(~np.isnan(lengths))
+        self.order = rows[np.argsort(lengths[rows], kind="stable")]
+        self.sorted_lengths = lengths[self.order]
+
+    def span(self, length_min, length_max):
+        """
+        (start, stop) of the BGCs with length_min <= BGC_length <= length_max within `order`.
+        """
+        start = np.searchsorted(self.sorted_lengths, length_min, side="left")
+        stop = np.searchsorted(self.sorted_lengths, length_max, side="right")
+        return start, max(start, stop)
+
+    def count(self, length_min, length_max):
+        start, stop = self.span(length_min, length_max)
+        return stop - start
+
+    def rows(self, length_min, length_max):
+        """
+        Row positions in the length window, ordered by length.
+        """
+        start, stop = self.span(length_min, length_max)
+        return self.order[start:stop]
+
+    def mask(self, length_min, length_max):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.rows(length_min, length_max)] = True
+        return mask
+
+
+###########################################
+#      COUNT CUBE
+###########################################
+# Dimensions of the count cube, stored as categorical codes of the table
+CUBE_DIMENSIONS = ["sample_id", "Product_class", "mmseqs_lineage_contig"]
+
+# Number of BGC_length bins; bins hold about equally many BGCs
+CUBE_LENGTH_BINS = 32
+
+
+class CountCube:
+    """
+    BGC counts per (sample, Product_class value, lineage, tool code, length bin), kept sparse as one
+    row per non-empty cell. The sidebar filters are answered as slices of the cells, so count-based
+    plots scale with the number of categories instead of the number of BGCs. Length bins that a
+    length window only partly covers are counted exactly from their rows.
+    BGCs without a length are left out, as no length window selects them.
+    """
+    def __init__(self, table, lengths=None):
+        self.categories = {column: table[column].cat.categories for column in CUBE_DIMENSIONS}
+        self.lengths = lengths if lengths is not None else LengthIndex(table["BGC_length"])
+        rows = self.lengths.order
+
+        # Codes in the order of the length index: bins are length ranges, so the rows of a bin,
+        # and those of a length window, are one slice of these arrays
+        self._codes = {column: table[column].cat.codes.to_numpy()[rows] for column in CUBE_DIMENSIONS}
+        self._codes["tool_code"] = tool_codes(table)[rows]
+        sorted_lengths = self.lengths.sorted_lengths
+        edges = np.unique(np.quantile(sorted_lengths, np.linspace(0, 1, CUBE_LENGTH_BINS + 1))) if len(rows) else np.zeros(1)
+        bins = np.searchsorted(edges[1:-1], sorted_lengths, side="right")
+        self._bin_starts = np.searchsorted(bins, np.arange(max(len(edges) - 1, 1) + 1))
+
+        cells = pd.DataFrame(dict(self._codes, length_bin=bins))
+        self.cells = cells.groupby(list(cells.columns), sort=False).size().reset_index(name="count")
+
+    def slice(self, tool_lookup, class_mask, length_min, length_max):
+        """
+        Counts of the BGCs passing the sidebar filters, per sample, Product_class and lineage and tool code.
+        `tool_lookup` is indexed by tool code and `class_mask` by Product_class code (see
+        ProductClassIndex.value_mask, None selects all classes); lengths are compared inclusively.
+        """
+        start, stop = self.lengths.span(length_min, length_max)
+        # Bins from first up to last lie inside the window; the rows before and after them are counted one by one
+        first = np.searchsorted(self._bin_starts, start, side="left")
+        last = np.searchsorted(self._bin_starts, stop, side="right") - 1
+        if first < last:
+            edges = [(start, self._bin_starts[first]), (self._bin_starts[last], stop)]
+        else:
+            first = last = 0
+            edges = [(start, stop)]
+
+        cells = self.cells
+        bins = cells["length_bin"].to_numpy()
+        mask = tool_lookup[cells["tool_code"].to_numpy()] & (bins >= first) & (bins < last)
+        if class_mask is not None:
+            mask &= class_mask[cells["Product_class"].to_numpy()]
+        parts = [cells[mask]]
+
+        for edge_start, edge_stop in edges:
+            codes = {column: values[edge_start:edge_stop] for column, values in self._codes.items()}
+            mask = tool_lookup[codes["tool_code"]]
+            if class_mask is not None:
+                mask &= class_mask[codes["Product_class"]]
+            parts.append(pd.DataFrame({column: values[mask] for column, values in codes.items()}).assign(count=1))
+
+        counts = pd.concat(parts, ignore_index=True)
+        counts = counts.groupby(CUBE_DIMENSIONS + ["tool_code"], sort=False)["count"].sum().reset_index()
+        return self.decode(counts)
+
+    def decode(self, counts):
+        """
+        Replace the dimension codes of `counts` by categoricals of the table's values.
+        """
+        for column in CUBE_DIMENSIONS:
+            counts[column] = pd.Categorical.from_codes(counts[column], categories=self.categories[column])
+        return counts
@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from background import BackgroundTask
+from instrumentation import instrumentation, row_count, span
+
+###########################################
+#      FIGURE CACHE
+###########################################
+# Memory limit of the cached figures, configurable through the environment; 0 disables the cache
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get("COMBGC_FIGURE_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+
+
+class FigureCache:
+    """
+    Process-wide LRU cache of built figures, shared by all sessions.
+    Keys combine the dataset fingerprint, the normalized filter state and the plot parameters, so a
+    revisited state or a view another session already built is returned without rebuilding it.
+    Entries are sized by figure_size and evicted least recently used first.
+    """
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, build, name="figure"):
+        """
+        The figure cached under `key`, or `build()` cached under `key`. Errors raised by `build` are not cached.
+        `name` labels the serialization of a built figure in the instrumentation, which measures its exact payload.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        figure = build()
+        if instrumentation is not None and figure is not None:
+            with span(f"{name}.serialize") as measured:
+                measured["payload_bytes"] = len(figure.to_json())
+        size = figure_size(figure)
+        if size > self.max_bytes:
+            return figure
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (figure, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Cache shared by all sessions of the server process
+figure_cache = FigureCache()
+
+
+def figure_size(figure):
+    """
+    Estimated memory of a figure: the bytes of its arrays plus the length of its strings and keys,
+    taken from the trace and layout properties without serializing them. None is 0 bytes.
+    """
+    if figure is None:
+        return 0
+    return _value_size(list(figure._data)) + _value_size(figure._layout)  # the properties plotly holds, not copies
+
+
+def _value_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key) + _value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return len(value) + sum(_value_size(item) for item in value)
+    return 8
+
+
+class BackgroundFigure:
+    """
+    The figure of one output, built in the render pool through the figure cache (see BackgroundTask).
+    """
+    def __init__(self, name):
+        self.name = name
+        self._task = BackgroundTask(figure_cache.get_or_build)
+
+    def _build(self, build, data):
+        with span(f"{self.name}.build", rows=row_count(data)):
+            return build(data)
+
+    def render(self, state, params, read, build):
+        """
+        The figure of the filter `state` (see filter_state) and the plot `params`; call from a render function.
+        `read` is called on the event loop for the reactive inputs of `build(read())`, which runs in the pool.
+        """
+        if state is None:
+            return None
+        key = (state, self.name, params)
+
+        def arguments():
+            data = read()
+            return key, lambda: self._build(build, data), self.name
+        return self._task.result(key, arguments)
@@ -0,0 +1,220 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+from shiny import reactive
+from shiny.session import get_current_session
+from shiny.types import SilentCancelOutputException, SilentException
+
+###########################################
+#      INSTRUMENTATION
+###########################################
+# Opt-in timing of the reactive calcs, renders and figure builds, plus the diagnostics tab
+INSTRUMENT = os.environ.get("COMBGC_INSTRUMENT", "").lower() in ("1", "true", "yes")
+
+# JSONL file every recorded event is appended to; unset keeps the events in memory only
+INSTRUMENT_LOG = os.environ.get("COMBGC_INSTRUMENT_LOG", "")
+
+# Number of recent events kept in memory for the diagnostics tab and its export
+INSTRUMENT_EVENTS = 10000
+
+# Columns of the per-node statistics
+STATS_COLUMNS = ["node", "calls", "invalidations", "errors", "total_s", "mean_s", "max_s", "last_s", "last_rows", "last_payload_bytes"]
+
+
+class Instrumentation:
+    """
+    Process-wide recorder of node timings. Every event is one execution of a node (a reactive calc or
+    render, or a span of plain code such as a figure build) with its duration, row count and payload
+    size; invalidations of reactive nodes are counted separately. Statistics are kept per node.
+    """
+    def __init__(self, log_path=INSTRUMENT_LOG, max_events=INSTRUMENT_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._log = open(log_path, "a", buffering=1) if log_path else None
+
+    def _node(self, node):
+        if node not in self._stats:
+            self._stats[node] = {"calls": 0, "invalidations": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0,
+                                 "last_s": None, "last_rows": None, "last_payload_bytes": None}
+        return self._stats[node]
+
+    def record(self, node, duration, rows=None, payload_bytes=None, error=None, session_id=None):
+        event = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "node": node,
+            "session": session_id,
+            "duration_s": duration,
+            "rows": rows,
+            "payload_bytes": payload_bytes,
+            "error": error,
+        }
+        with self._lock:
+            stats = self._node(node)
+            stats["calls"] += 1
+            stats["errors"] += error is not None
+            stats["total_s"] += duration
+            stats["max_s"] = max(stats["max_s"], duration)
+            stats["last_s"] = duration
+            if rows is not None:
+                stats["last_rows"] = rows
+            if payload_bytes is not None:
+                stats["last_payload_bytes"] = payload_bytes
+            self.events.append(event)
+            if self._log is not None:
+                self._log.write(json.dumps(event) + "\n")
+
+    def invalidated(self, node):
+        with self._lock:
+            self._node(node)["invalidations"] += 1
+
+    def stats(self):
+        """
+        Per-node statistics as a frame of STATS_COLUMNS, the nodes with the most total time first.
+        """
+        with self._lock:
+            rows = [{"node": node, **stats, "mean_s": stats["total_s"] / stats["calls"] if stats["calls"] else None}
+                    for node, stats in self._stats.items()]
+        return pd.DataFrame(rows, columns=STATS_COLUMNS).sort_values("total_s", ascending=False, ignore_index=True)
+
+    def iter_jsonl(self):
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            yield json.dumps(event) + "\n"
+
+
+# Recorder shared by all sessions of the server process, None unless COMBGC_INSTRUMENT is set
+instrumentation = Instrumentation() if INSTRUMENT else None
+
+
+def row_count(value):
+    """
+    Number of rows of a frame, RowView or dataset result; None for other values.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)) or hasattr(value, "rows") or hasattr(value, "table"):
+        return len(value)
+    return None
+
+
+def rows_of(calc):
+    """
+    `rows` argument of `timed` recording the length of the value of `calc`, e.g. the view a node filters.
+    """
+    def rows(*args, **kwargs):
+        value = calc()
+        return None if value is None else len(value)
+    return rows
+
+
+def input_rows(rows, args, kwargs, result):
+    """
+    Rows a node worked on: `rows(*args, **kwargs)` when given, read without taking new reactive
+    dependencies, otherwise the rows of its result.
+    """
+    if rows is None:
+        return row_count(result)
+    try:
+        with reactive.isolate():
+            return rows(*args, **kwargs)
+    except Exception:
+        return None
+
+
+def payload_size(value):
+    """
+    Size of a text or data grid result as sent to the browser; None for other values. Figures are
+    measured once when they are built (see figure_cache.BackgroundFigure), not on every render.
+    """
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(getattr(value, "data", None), pd.DataFrame):
+        return len(value.data.to_json(orient="split"))
+    return None
+
+
+def timed(name, rows=None):
+    """
+    Decorator recording every execution of a reactive calc or render function under `name`, namespaced
+    by the module it runs in, along with the invalidations of its reactive context. Place it below the
+    reactive decorators. Without COMBGC_INSTRUMENT the function is returned unchanged.
+    `rows` gives the size of the input, called with the function's arguments after it returned (see
+    rows_of); without it the rows of the result are recorded.
+    """
+    def decorator(func):
+        if instrumentation is None:
+            return func
+
+        def start():
+            session = get_current_session()
+            node = session.ns(name) if session is not None else name
+            try:
+                reactive.get_current_context().on_invalidate(lambda: instrumentation.invalidated(node))
+            except RuntimeError:
+                pass  # Not called from a reactive context
+            return node, None if session is None else session.id, time.perf_counter()
+
+        def finish(node, session_id, started, result=None, error=None, size=None):
+            instrumentation.record(node, time.perf_counter() - started, rows=size,
+                                   payload_bytes=payload_size(result), error=error, session_id=session_id)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                node, session_id, started = start()
+                try:
+                    result = await func(*args, **kwargs)
+                except (SilentException, SilentCancelOutputException):
+                    finish(node, session_id, started)
+                    raise
+                except Exception as error:
+                    finish(node, session_id, started, error=type(error).__name__)
+                    raise
+                finish(node, session_id, started, result, size=input_rows(rows, args, kwargs, result))
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                node, session_id, started = start()
+                try:
+                    result = func(*args, **kwargs)
+                except (SilentException, SilentCancelOutputException):
+                    finish(node, session_id, started)
+                    raise
+                except Exception as error:
+                    finish(node, session_id, started, error=type(error).__name__)
+                    raise
+                finish(node, session_id, started, result, size=input_rows(rows, args, kwargs, result))
+                return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def span(name, rows=None):
+    """
+    Record the code in the `with` block under `name`, e.g. work done in the render pool outside any
+    reactive context. `rows` is the size of the input the block works on. The yielded dict takes a
+    "payload_bytes" entry. Does nothing without COMBGC_INSTRUMENT.
+    """
+    measured = {"payload_bytes": None}
+    if instrumentation is None:
+        yield measured
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield measured
+    except Exception as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        instrumentation.record(name, time.perf_counter() - started, rows=rows, payload_bytes=measured["payload_bytes"], error=error)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+###########################################
+#      CONTIG INTERVAL INDEX
+###########################################
+# Columns of the overlap join result
+OVERLAP_COLUMNS = ["row_id", "other_row_id", "overlap"]
+
+
+class ContigIntervalIndex:
+    """
+    BGC intervals sorted by (sample_id, contig_id, BGC_start), built once at load.
+    Each contig is a contiguous run of the sorted arrays and a BGC can only overlap a position when it
+    starts at most one contig-wide maximum BGC length before it. A query is therefore two binary searches
+    followed by a scan of the hits and the few BGCs starting in that window. Coordinates are inclusive.
+    """
+    def __init__(self, table):
+        starts = table["BGC_start"].to_numpy(dtype=float, na_value=np.nan)
+        ends = table["BGC_end"].to_numpy(dtype=float, na_value=np.nan)
+        samples = table["sample_id"].cat.codes.to_numpy()
+        contigs = table["contig_id"].cat.codes.to_numpy()
+        valid = ~np.isnan(starts) & ~np.isnan(ends) & (samples >= 0) & (contigs >= 0)
+        rows = np.flatnonzero(valid)
+
+        self.sample_categories = table["sample_id"].cat.categories
+        self.contig_categories = table["contig_id"].cat.categories
+        self.order = rows[np.lexsort((starts[rows], contigs[rows], samples[rows]))]
+        self.starts = starts[self.order].astype(np.int64)
+        self.ends = ends[self.order].astype(np.int64)
+
+        # Contig runs of the sorted arrays, keyed by (sample code, contig code)
+        samples, contigs = samples[self.order], contigs[self.order]
+        changes = (np.diff(samples) != 0) | (np.diff(contigs) != 0)
+        self.run_starts = np.flatnonzero(np.concatenate([[len(samples) > 0], changes]))
+        self.run_stops = np.append(self.run_starts[1:], len(self.order))
+        self._runs = {(samples[first], contigs[first]): run for run, first in enumerate(self.run_starts)}
+        self.groups = np.repeat(np.arange(len(self.run_starts)), self.run_stops - self.run_starts)
+        lengths = self.ends - self.starts
+        self.max_lengths = np.maximum.reduceat(lengths, self.run_starts) if len(lengths) else np.zeros(0, dtype=np.int64)
+
+        # One sorted key over all contigs: run number in the high digits, start position in the low ones
+        self._scale = int(max(self.ends.max(initial=0), 0)) + 1
+        self._keys = self.groups * self._scale + self.starts
+
+    def __len__(self):
+        return len(self.order)
+
+    def contigs(self, sample_id):
+        """
+        Contig IDs of `sample_id` that carry BGCs.
+        """
+        sample = self.sample_categories.get_indexer([sample_id])[0]
+        return [self.contig_categories[contig] for (run_sample, contig) in self._runs if run_sample == sample]
+
+    def query(self, sample_id, contig_id, start, end):
+        """
+        Row positions of the BGCs on `contig_id` of `sample_id` that overlap [start, end], ordered by start.
+        """
+        sample = self.sample_categories.get_indexer([sample_id])[0]
+        contig = self.contig_categories.get_indexer([contig_id])[0]
+        run = self._runs.get((sample, contig))
+        if run is None:
+            return np.zeros(0, dtype=np.int64)
+        first, stop = self.run_starts[run], self.run_stops[run]
+        low = first + np.searchsorted(self.starts[first:stop], start - self.max_lengths[run], side="left")
+        high = first + np.searchsorted(self.starts[first:stop], end, side="right")
+        candidates = np.arange(low, high)
+        return self.order[candidates[self.ends[candidates] >= start]]
+
+    def overlap_join(self, rows=None, others=None, min_overlap=1):
+        """
+        Pairs of overlapping BGCs on the same contig as a frame of OVERLAP_COLUMNS, `overlap` in bp.
+        Pairs are taken from `rows` to `others` (row positions, default all BGCs), without self pairs;
+        each unordered pair appears in both directions when both rows are in both sets.
+        """
+        left = self._positions(rows)
+        right = np.zeros(len(self.order), dtype=bool)
+        right[self._positions(others)] = True
+        if not len(left):
+            return pd.DataFrame({column: np.zeros(0, dtype=np.int64) for column in OVERLAP_COLUMNS})
+
+        groups = self.groups[left]
+        low = np.searchsorted(self._keys, groups * self._scale + self.starts[left] - self.max_lengths[groups], side="left")
+        low = np.maximum(low, self.run_starts[groups])
+        high = np.searchsorted(self._keys, groups * self._scale + self.ends[left], side="right")
+        counts = np.maximum(high - low, 0)
+
+        # Expand every left BGC into its candidate range in one pass
+        pair_left = np.repeat(left, counts)
+        pair_right = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(low, counts)
+        overlap = np.minimum(self.ends[pair_left], self.ends[pair_right]) - np.maximum(self.starts[pair_left], self.starts[pair_right]) + 1
+        keep = right[pair_right] & (pair_left != pair_right) & (overlap >= max(min_overlap, 1))
+
+        return pd.DataFrame({
+            "row_id": self.order[pair_left[keep]],
+            "other_row_id": self.order[pair_right[keep]],
+            "overlap": overlap[keep],
+        })
+
+    def _positions(self, rows):
+        """
+        Positions in the sorted arrays of the given row positions; rows without coordinates are dropped.
+        """
+        if rows is None:
+            return np.arange(len(self.order))
+        position_of = np.full(self.order.max(initial=-1) + 1, -1, dtype=np.int64)
+        position_of[self.order] = np.arange(len(self.order))
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < len(position_of)]
+        positions = position_of[rows]
+        return np.sort(positions[positions >= 0])
@@ -0,0 +1,441 @@
+import bz2
+import gzip
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
+
+###########################################
+#      SCHEMA
+###########################################
+# Prediction tools reported by comBGC, in the order of the flag columns
+TOOL_COLUMNS = ["deepBGC", "GECCO", "antiSMASH"]
+
+# Repeated string columns, dictionary-encoded as pandas categoricals
+CATEGORICAL_COLUMNS = ["sample_id", "contig_id", "Product_class", "Tool_representative", "mmseqs_lineage_contig"]
+
+# Explicit in-memory dtype of every column of a comBGC table
+COMBGC_SCHEMA = {
+    "sample_id": "category",
+    "contig_id": "category",
+    "BGC_start": "int32",
+    "BGC_end": "int32",
+    "BGC_length": "int32",
+    "deepBGC": "bool",
+    "GECCO": "bool",
+    "antiSMASH": "bool",
+    "merged": "uint16",
+    "Product_class": "category",
+    "Tool_representative": "category",
+    "BGC_probability": "float32",
+    "mmseqs_lineage_contig": "category",
+}
+
+# Dtypes handed to the CSV parser; coordinates are written as "7807.0" so they are parsed as floats first
+READ_DTYPES = {
+    "sample_id": "category",
+    "contig_id": "category",
+    "BGC_start": "float64",
+    "BGC_end": "float64",
+    "BGC_length": "float64",
+    "deepBGC": "category",
+    "GECCO": "category",
+    "antiSMASH": "category",
+    "merged": "float64",
+    "Product_class": "category",
+    "Tool_representative": "category",
+    "BGC_probability": "float64",
+    "mmseqs_lineage_contig": "category",
+}
+
+# Rows per chunk when a table is parsed with the pandas C engine
+READ_CHUNK_ROWS = 200000
+
+# Column naming the file each BGC was read from when several tables are combined
+SOURCE_FILE_COLUMN = "source_file"
+
+# Compressed tables are decompressed as a stream straight into the parser, keyed by file suffix
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+
+# Uploads read as a single comBGC table, and archives whose table members are read as tables
+TABLE_SUFFIXES = (".tsv",) + tuple(f".tsv{suffix}" for suffix in COMPRESSIONS)
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Rows written per batch by the streaming TSV export
+EXPORT_CHUNK_ROWS = 50000
+
+# Columns of the upload that are never used by the interface
+DROPPED_COLUMNS = ["identifier"]
+
+# Taxonomic ranks of the mmseqs lineage, added as categorical columns at load
+TAXONOMY_LEVELS = ["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+# Columns computed at load that are not part of the comBGC table itself
+DERIVED_COLUMNS = TAXONOMY_LEVELS + ["tool_code", "contig_length"]
+
+
+###########################################
+#      READ TABLE
+###########################################
+def has_pyarrow():
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_combgc_table(source, engine=None, name=None):
+    """
+    Read a comBGC summary table (TSV) into a typed DataFrame following COMBGC_SCHEMA.
+    `engine` is "pyarrow" or "c"; by default pyarrow is used when it is installed.
+    Compressed tables are detected by the suffix of `name`, or of `source` when it is a path.
+    """
+    return add_derived_columns(_read_typed(source, engine, name))
+
+
+def read_combgc_tables(files, engine=None, max_workers=None, progress=None):
+    """
+    Read several comBGC tables into one typed DataFrame with a `source_file` column.
+    `files` are (name, path) pairs of .tsv files or .zip/.tar archives of them. Tables are parsed in
+    parallel and typed before they are combined; `progress(done, total, name)` is called after each.
+    """
+    tasks = [task for name, path in files for task in _table_tasks(name, path)]
+    frames = [None] * len(tasks)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(read, engine): (i, name) for i, (name, read) in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i, name = futures[future]
+            frames[i] = future.result()
+            if progress is not None:
+                progress(done, len(tasks), name)
+
+    frames = [frame for task_frames in frames for frame in task_frames]
+    if not frames:
+        raise ValueError("No comBGC tables (.tsv) found in the uploaded files.")
+    return add_derived_columns(concat_tables(frames))
+
+
+def _table_tasks(name, path):
+    """
+    (name, read) tasks for an uploaded file; `read(engine)` returns a list of typed frames.
+    Zip members are read in parallel, tar archives are streamed member by member in a single task.
+    Archive members are labelled "archive/member", so equally named members of two archives stay apart.
+    """
+    lower = name.lower()
+    if lower.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [member for member in archive.namelist() if member.lower().endswith(TABLE_SUFFIXES)]
+        return [(f"{name}/{member}", _zip_member_reader(path, name, member)) for member in members]
+    if lower.endswith(ARCHIVE_SUFFIXES):
+        return [(name, lambda engine: _read_tar(path, name, engine))]
+    return [(name, lambda engine: [_read_source_file(path, name, engine)])]
+
+
+def _zip_member_reader(path, name, member):
+    def read(engine):
+        with zipfile.ZipFile(path) as archive, archive.open(member) as handle:
+            return [_read_source_file(handle, f"{name}/{member}", engine)]
+    return read
+
+
+def _read_tar(path, name, engine):
+    frames = []
+    with tarfile.open(path, mode="r:*") as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(TABLE_SUFFIXES):
+                with archive.extractfile(member) as handle:
+                    frames.append(_read_source_file(handle, f"{name}/{member.name}", engine))
+    return frames
+
+
+def _read_source_file(source, name, engine):
+    df = _read_typed(source, engine, name)
+    df[SOURCE_FILE_COLUMN] = pd.Categorical([name] * len(df))
+    return df
+
+
+def _read_typed(source, engine, name=None):
+    """
+    Parse a table and cast it to COMBGC_SCHEMA, without the derived columns.
+    """
+    if name is None and isinstance(source, (str, os.PathLike)):
+        name = source
+    compression = compression_of(name)
+    if compression is not None:
+        with open_decompressed(source, compression) as stream:
+            return _read_typed(stream, engine, name="")
+
+    if engine is None:
+        engine = "pyarrow" if has_pyarrow() else "c"
+
+    if engine == "pyarrow":
+        return apply_schema(_read_pyarrow(source))
+    if engine == "c":
+        # Parse in chunks so only one chunk of untyped columns is held in memory at a time
+        chunks = pd.read_csv(
+            source,
+            sep="\t",
+            usecols=lambda column: column not in DROPPED_COLUMNS,
+            dtype=READ_DTYPES,
+            chunksize=READ_CHUNK_ROWS,
+        )
+        return concat_tables([apply_schema(chunk) for chunk in chunks])
+    raise ValueError(f"Unknown engine '{engine}', expected 'pyarrow' or 'c'.")
+
+
+def compression_of(name):
+    """
+    Compression of a file named `name`, from its suffix, or None for plain files.
+    """
+    name = str(name or "").lower()
+    return next((compression for suffix, compression in COMPRESSIONS.items() if name.endswith(suffix)), None)
+
+
+def open_decompressed(source, compression):
+    """
+    A binary stream of the decompressed contents of `source`, a path or a binary file object.
+    Data is inflated block by block as the parser reads, no decompressed copy is written to disk.
+    """
+    if compression == "gzip":
+        return gzip.open(source, "rb")
+    if compression == "bz2":
+        return bz2.open(source, "rb")
+    if compression == "xz":
+        return lzma.open(source, "rb")
+    if compression != "zstd":
+        raise ValueError(f"Unknown compression '{compression}'.")
+
+    # zstd is not in the standard library: use zstandard when installed, otherwise the pyarrow codec
+    is_path = isinstance(source, (str, os.PathLike))
+    try:
+        import zstandard
+    except ImportError:
+        if not has_pyarrow():
+            raise ValueError("Reading .zst files requires the zstandard or pyarrow package.")
+        import pyarrow as pa
+        raw = pa.OSFile(os.fspath(source)) if is_path else pa.PythonFile(source, mode="r")
+        return pa.CompressedInputStream(raw, "zstd")
+    if is_path:
+        return zstandard.open(source, "rb")
+    return zstandard.ZstdDecompressor().stream_reader(source)
+
+
+def concat_tables(frames):
+    """
+    Concatenate typed tables column by column, merging the categories of categorical columns
+    so they are never expanded to Python strings. Columns missing from some tables are filled
+    with NA (False for tool flags) and the result is cast to COMBGC_SCHEMA again.
+    """
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    names = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    columns = {}
+    for column in names:
+        dtype = next(frame[column].dtype for frame in frames if column in frame.columns)
+        parts = [frame[column] if column in frame.columns else _missing_column(dtype, len(frame)) for frame in frames]
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[column] = pd.Series(union_categoricals([part.astype("category") for part in parts]))
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return apply_schema(pd.DataFrame(columns))
+
+
+def _missing_column(dtype, length):
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.Series(pd.Categorical([None] * length))
+    if dtype == bool:
+        return pd.Series(np.zeros(length, dtype=bool))
+    return pd.Series(np.full(length, np.nan))
+
+
+def add_derived_columns(df):
+    df = add_tool_code(df)
+    df = add_contig_length(df)
+    return add_taxonomy_columns(df)
+
+
+def _read_pyarrow(source):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    column_types = {column: dictionary for column in CATEGORICAL_COLUMNS + TOOL_COLUMNS}
+    column_types.update({column: pa.float64() for column, dtype in READ_DTYPES.items() if dtype == "float64"})
+
+    table = pacsv.read_csv(
+        source,
+        parse_options=pacsv.ParseOptions(delimiter="\t"),
+        convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+    table = table.drop_columns([column for column in DROPPED_COLUMNS if column in table.column_names])
+    return table.to_pandas()
+
+
+def apply_schema(df):
+    """
+    Cast a raw comBGC table to COMBGC_SCHEMA. Missing lineages become "" and the index is reset
+    so that index labels are the row positions of the table.
+    """
+    df = df.drop(columns=[column for column in DROPPED_COLUMNS if column in df.columns])
+    if "mmseqs_lineage_contig" not in df.columns:
+        df["mmseqs_lineage_contig"] = ""
+
+    for column in TOOL_COLUMNS:
+        if column in df.columns and df[column].dtype != bool:
+            df[column] = (df[column] == "Yes").fillna(False).astype(bool)
+
+    for column in ["BGC_start", "BGC_end", "BGC_length"]:
+        values = pd.to_numeric(df[column])
+        # Nullable coordinates cannot be stored as int32, keep them as float32
+        df[column] = values.astype("float32") if values.isna().any() else values.astype("int32")
+
+    if "merged" in df.columns:
+        df["merged"] = pd.to_numeric(df["merged"]).fillna(1).astype(COMBGC_SCHEMA["merged"])
+    if "BGC_probability" in df.columns:
+        df["BGC_probability"] = pd.to_numeric(df["BGC_probability"]).astype(COMBGC_SCHEMA["BGC_probability"])
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    lineage = df["mmseqs_lineage_contig"]
+    if "" not in lineage.cat.categories:
+        lineage = lineage.cat.add_categories("")
+    df["mmseqs_lineage_contig"] = lineage.fillna("")
+
+    return df.reset_index(drop=True)
+
+
+###########################################
+#      TOOL CODE
+###########################################
+def tool_codes(df):
+    """
+    Tool membership of every BGC as a bit code: bit i is set when TOOL_COLUMNS[i] detected the BGC.
+    """
+    if "tool_code" in df.columns:
+        return df["tool_code"].to_numpy()
+    codes = np.zeros(len(df), dtype=np.uint8)
+    for bit, column in enumerate(TOOL_COLUMNS):
+        codes |= df[column].to_numpy(dtype=bool).astype(np.uint8) << bit
+    return codes
+
+
+def add_tool_code(df):
+    df["tool_code"] = tool_codes(df)
+    return df
+
+
+def tool_code_counts(codes, weights=None):
+    """
+    Number of BGCs per tool code, indexed by code (length 2 ** len(TOOL_COLUMNS)).
+    `weights` gives the number of BGCs behind each code, e.g. the counts of a count cube.
+    """
+    counts = np.bincount(codes, weights=weights, minlength=2 ** len(TOOL_COLUMNS))
+    return counts if weights is None else counts.astype(int)
+
+
+def tool_code_lookup(selected_tools, all_selected=False):
+    """
+    Boolean lookup table over all tool codes: True for the codes kept by the tool selection.
+    With `all_selected` only BGCs detected by every tool are kept.
+    """
+    codes = np.arange(2 ** len(TOOL_COLUMNS))
+    if all_selected:
+        return codes == len(codes) - 1
+    selected_bits = sum(1 << bit for bit, column in enumerate(TOOL_COLUMNS) if column in selected_tools)
+    return (codes & selected_bits) > 0
+
+
+###########################################
+#      CONTIG LENGTH
+###########################################
+def contig_lengths(df):
+    """
+    Contig length parsed from the "NODE_1_length_30101_cov_36.6" style contig_id, as a nullable Int32 Series.
+    Contig IDs without a length field give <NA>.
+    """
+    if "contig_length" in df.columns:
+        return df["contig_length"]
+    contig_id = df["contig_id"].astype("category")
+    # Extract once per distinct contig, then broadcast through the codes (-1 picks the appended NaN)
+    lengths = pd.to_numeric(contig_id.cat.categories.str.extract(r"length_(\d+)", expand=False)).to_numpy(dtype=float)
+    lengths = np.append(lengths, np.nan)[contig_id.cat.codes.to_numpy()]
+    return pd.Series(lengths, index=df.index).astype("Int32")
+
+
+def add_contig_length(df):
+    df["contig_length"] = contig_lengths(df)
+    return df
+
+
+###########################################
+#      TAXONOMY
+###########################################
+def parse_lineage(lineage):
+    """
+    Split a "d_Bacteria;p_Proteobacteria;..." lineage into one name per rank of TAXONOMY_LEVELS.
+    """
+    names = []
+    for rank in lineage.split(";")[:len(TAXONOMY_LEVELS)]:
+        parts = rank.split("_")
+        names.append(parts[1] if len(parts) > 1 else None)
+    return names + [None] * (len(TAXONOMY_LEVELS) - len(names))
+
+
+def add_taxonomy_columns(df, column_name="mmseqs_lineage_contig"):
+    """
+    Add one categorical column per taxonomic rank. Lineages are parsed once per unique lineage string
+    and the result is broadcast to the rows through the categorical codes.
+    """
+    lineage = df[column_name].astype("category")
+    parsed = pd.DataFrame([parse_lineage(value) for value in lineage.cat.categories], columns=TAXONOMY_LEVELS)
+    codes = lineage.cat.codes.to_numpy()
+
+    for level in TAXONOMY_LEVELS:
+        # String-typed categories, so ranks without any name still round-trip through Parquet as categoricals
+        level_values = pd.Categorical(parsed[level].astype("string"))
+        # Missing lineages have code -1, which picks the appended -1 (missing rank)
+        level_codes = np.append(level_values.codes, -1)[codes]
+        df[level] = pd.Categorical.from_codes(level_codes, categories=level_values.categories)
+    return df
+
+
+###########################################
+#      EXPORT
+###########################################
+def export_frame(df):
+    """
+    Convert a typed table back to the comBGC layout ("Yes"/empty tool flags, no derived columns)
+    for display and download.
+    """
+    df = df.drop(columns=[column for column in DERIVED_COLUMNS if column in df.columns])
+    for column in TOOL_COLUMNS:
+        if column in df.columns:
+            df[column] = np.where(df[column], "Yes", None)
+    return df
+
+
+def iter_tsv(df, chunk_rows=EXPORT_CHUNK_ROWS, compress=False):
+    """
+    Yield the comBGC TSV export of `df` in batches of `chunk_rows` rows, so an export never
+    holds more than one batch in memory. With `compress` the batches form a single gzip stream (bytes).
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = export_frame(df.iloc[start:start + chunk_rows]).to_csv(sep="\t", index=False, header=start == 0)
+        if compressor is None:
+            yield chunk
+        else:
+            compressed = compressor.compress(chunk.encode())
+            if compressed:
+                yield compressed
+    if compressor is not None:
+        yield compressor.flush()
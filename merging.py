@@ -0,0 +1,60 @@
+import numpy as np
+
+from intervals import ContigIntervalIndex
+from loader import TOOL_COLUMNS, concat_tables, tool_codes
+
+###########################################
+#      BGC MERGING
+###########################################
+def merge_bgcs(table, min_overlap_fraction=0.0, intervals=None):
+    """
+    Re-cluster overlapping BGCs per contig and return one row per cluster.
+    BGCs are swept in start order; a BGC joins the open cluster when it overlaps the furthest-reaching
+    earlier BGC of the contig by at least `min_overlap_fraction` of the shorter of the two (and by at
+    least 1 bp). A cluster spans its members, carries the union of their tool flags and the sum of their
+    `merged` counts, and takes its other columns, including Tool_representative, from its longest member.
+    Coordinates are half-open like BGC_length (end - start), so BGCs that only touch do not overlap.
+    Rows without coordinates are kept as they are. `intervals` is the table's ContigIntervalIndex, if built.
+    """
+    intervals = intervals if intervals is not None else ContigIntervalIndex(table)
+    order, starts, ends, groups = intervals.order, intervals.starts, intervals.ends, intervals.groups
+    lengths = ends - starts
+
+    # Furthest-reaching earlier BGC of the same contig: running maximum of the end, made monotone across contigs
+    reach = groups * (ends.max(initial=0) + 1) + ends
+    running = np.maximum.accumulate(reach) if len(reach) else reach
+    furthest = np.maximum.accumulate(np.where(reach == running, np.arange(len(reach)), 0)) if len(reach) else reach
+    previous = np.concatenate([[0], furthest[:-1]]).astype(np.int64) if len(reach) else reach
+
+    overlap = np.minimum(ends[previous], ends) - starts
+    required = np.maximum(min_overlap_fraction * np.minimum(lengths[previous], lengths), 1)
+    joins = (groups[previous] == groups) & (overlap >= required)
+    if len(joins):
+        joins[0] = False
+    cluster_starts = np.flatnonzero(~joins)
+    labels = np.cumsum(~joins) - 1
+
+    # Longest member of each cluster, the first in start order on ties
+    by_length = np.lexsort((-lengths, labels))
+    representatives = by_length[np.searchsorted(labels[by_length], np.arange(len(cluster_starts)))]
+
+    merged = table.iloc[order[representatives]].copy()
+    if len(cluster_starts):
+        merged["BGC_start"] = np.minimum.reduceat(starts, cluster_starts).astype(table["BGC_start"].dtype)
+        merged["BGC_end"] = np.maximum.reduceat(ends, cluster_starts).astype(table["BGC_end"].dtype)
+        codes = np.bitwise_or.reduceat(tool_codes(table)[order], cluster_starts)
+        counts = np.add.reduceat(table["merged"].to_numpy(dtype=np.int64)[order], cluster_starts)
+    else:
+        codes = counts = np.zeros(0, dtype=np.int64)
+    merged["BGC_length"] = (merged["BGC_end"].to_numpy(dtype=np.int64) - merged["BGC_start"].to_numpy(dtype=np.int64)).astype(table["BGC_length"].dtype)
+    merged["merged"] = counts.astype(table["merged"].dtype)
+    for bit, column in enumerate(TOOL_COLUMNS):
+        merged[column] = (codes & (1 << bit)) > 0
+    if "tool_code" in merged.columns:
+        merged["tool_code"] = codes.astype(table["tool_code"].dtype)
+
+    # Rows without coordinates are not part of any cluster
+    unplaced = np.setdiff1d(np.arange(len(table)), order)
+    if len(unplaced):
+        merged = concat_tables([merged, table.iloc[unplaced]])
+    return merged.reset_index(drop=True)
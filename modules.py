@@ -1,24 +1,210 @@
+import logging
+
+import numpy as np
 import pandas as pd
 from typing import Callable
-from shiny import Inputs, Outputs, Session, module, render, ui, reactive
+from shiny import Inputs, Outputs, Session, module, render, ui, reactive, req
+from shiny.types import SilentException
 from shinywidgets import output_widget, render_widget
 import plotly.express as px
 
+from dataset import ComBGCDataset
+from figure_cache import BackgroundFigure, figure_cache
+from instrumentation import instrumentation, rows_of, span, timed
+from loader import TOOL_COLUMNS, export_frame, iter_tsv, tool_code_lookup, tool_codes
+from table_engine import PAGE_SIZES, ROW_ID_COLUMN, PagedTable, RowView, display_frame, page_count, parse_filters
 
 from plots import (
     boxplot_product_classes, 
-    stacked_bars_product_classes, 
-    create_venn, 
+    stacked_bars_product_classes_from_counts, 
+    create_venn_from_counts, 
     plot_combgc_sankey, 
-    preprocess_taxonomy_column, 
-    stacked_bars_taxonomy,
-    scatter_bgc_contig_classes
+    preprocess_taxonomy_column,
+    stacked_bars_taxonomy_from_counts,
+    scatter_bgc_contig_classes,
+    scatter_class_counts,
+    SCATTER_POINT_BUDGET,
+    SANKEY_TOP_N,
     )
 
 ###########################################
 #SHINY VERSION == 0.7.1
 ###########################################
 
+logger = logging.getLogger(__name__)
+
+# Number of scatter panels built by default; further classes are added from the selector
+SCATTER_DEFAULT_PANELS = 3
+
+# Number of taxonomy names selected by default, the ones with the most BGCs at the chosen level
+TAXONOMY_DEFAULT_OPTIONS = 10
+
+
+def download_filename(filename, compress):
+    return f"{filename}.gz" if compress else filename
+
+
+def read_quietly(calc):
+    """
+    `calc()` for an Effect. An error in an Effect closes the session, so a failing calc stops the
+    Effect silently instead; the outputs that read the same calc show the error.
+    """
+    try:
+        return calc()
+    except SilentException:
+        raise
+    except Exception as error:
+        raise SilentException() from error
+
+
+###########################################
+#       PAGED TABLE
+###########################################
+@module.ui
+def paged_table_ui(row_selection=False):
+    selection_controls = []
+    if row_selection:
+        selection_controls = [
+            ui.input_action_button("clear_selection", "Clear selection", class_="btn btn-outline-dark", style="font-size: 12px; padding: 2px 10px;"),
+        ]
+    return ui.div(
+        ui.row(
+            ui.column(6, ui.input_text("filters", "Column filters:", placeholder="e.g. Product_class: RiPP; BGC_length: >5000; GECCO: yes", width="100%")),
+            ui.column(3, ui.input_select("sort_column", "Sort by:", choices={"": "(row ID)"})),
+            ui.column(3, ui.input_radio_buttons("sort_direction", "Order:", choices={"asc": "Ascending", "desc": "Descending"}, inline=True)),
+        ),
+        ui.row(
+            ui.column(2, ui.input_select("page_size", "Rows per page:", choices=PAGE_SIZES)),
+            ui.column(2, ui.input_numeric("page", "Page:", value=1, min=1, step=1)),
+            ui.column(8, ui.output_text("page_info"), *selection_controls),
+        ),
+        ui.output_data_frame("table_page"),
+    )
+
+
+@module.server
+def paged_table_server(
+    input: Inputs,
+    output: Outputs,
+    session: Session,
+    df: Callable[[], pd.DataFrame],
+    row_selection: bool = False,
+    ):
+    """
+    Filters, sorts and pages `df` on the server and only sends the visible window to the browser.
+    `df` may return a RowView instead of a frame. Returns a function giving the stable row IDs
+    selected by the user across pages; selections are kept across filter changes while their rows
+    are in `df`, and dropped when `df` is taken from another table (e.g. a new upload).
+    """
+    selection = reactive.Value((None, frozenset()))  # (table the row IDs refer to, selected row IDs)
+    page_selection = reactive.Value((None, frozenset()))  # (page window, row IDs selected in it)
+
+    @reactive.Calc()
+    @timed("engine")
+    def engine():
+        data = df()
+        if data is None:
+            return None
+        return PagedTable(data)
+
+    @reactive.Effect
+    def update_sort_choices():
+        def columns_of_table():
+            table = engine()
+            return [] if table is None else export_frame(table.table.iloc[:0]).columns
+
+        columns = read_quietly(columns_of_table)
+        with reactive.isolate():
+            selected = input.sort_column() if input.sort_column() in columns else ""
+        ui.update_select("sort_column", choices={"": "(row ID)", **{column: column for column in columns}}, selected=selected)
+
+    @reactive.Calc()
+    @timed("positions", rows=rows_of(engine))
+    def positions():
+        table = engine()
+        if table is None:
+            return None
+        return table.rows(parse_filters(input.filters()), input.sort_column() or None, input.sort_direction() == "asc")
+
+    @reactive.Effect
+    @reactive.event(lambda: read_quietly(positions), input.page_size)
+    def reset_page():
+        ui.update_numeric("page", value=1)
+
+    @reactive.Calc()
+    @timed("current_page", rows=rows_of(positions))
+    def current_page():
+        table = engine()
+        rows = positions()
+        if table is None:
+            return None
+        page_size = int(input.page_size())
+        page = min(max(1, input.page() or 1), page_count(len(rows), page_size))
+        return table.page(rows, page, page_size)
+
+    @output
+    @render.text
+    def page_info():
+        table = engine()
+        window = current_page()
+        if table is None or window is None:
+            return ""
+        n_rows = len(positions())
+        page_size = int(input.page_size())
+        page = min(max(1, input.page() or 1), page_count(n_rows, page_size))
+        first = min((page - 1) * page_size + 1, n_rows)
+        return f"Rows {first}-{first + len(window) - 1 if len(window) else 0} of {n_rows} matching ({len(table)} total), page {page} of {page_count(n_rows, page_size)}"
+
+    @render.data_frame
+    @timed("table_page", rows=rows_of(current_page))
+    def table_page():
+        window = current_page()
+        if window is None:
+            return None
+        return render.DataGrid(window,
+                               row_selection_mode="multiple" if row_selection else "none",
+                               width="100%",
+                               height="600px")
+
+    @reactive.Effect
+    @reactive.event(input.table_page_selected_rows, ignore_none=False)
+    def record_selection():
+        """
+        Apply the selection changes of the shown page by row ID. The grid starts every page without a
+        selection, so rows selected on other pages or before a filter change stay selected.
+        """
+        if not row_selection:
+            return
+        table = read_quietly(engine)
+        window = read_quietly(current_page)
+        if table is None or window is None:
+            return
+        indices = [index for index in input.table_page_selected_rows() or [] if index < len(window)]
+        selected_on_page = frozenset(int(row_id) for row_id in window[ROW_ID_COLUMN].iloc[indices])
+        shown_window, previous_on_page = page_selection.get()
+        if shown_window is not window:
+            previous_on_page = frozenset()
+        selected_table, selected = selection.get()
+        if selected_table is not table.table:
+            selected = frozenset()
+        selection.set((table.table, (selected - previous_on_page) | selected_on_page))
+        page_selection.set((window, selected_on_page))
+
+    @reactive.Effect
+    @reactive.event(input.clear_selection)
+    def clear_selection():
+        selection.set((None, frozenset()))
+
+    def selected_row_ids():
+        table = engine()
+        selected_table, selected = selection.get()
+        if table is None or selected_table is not table.table:
+            return []
+        return table.row_ids(selected)
+
+    return selected_row_ids
+
+
 ###########################################
 #       TABLE
 ###########################################
@@ -30,12 +216,13 @@ def combgc_table_ui():
         ui.p("Download only the selected rows:"),
         ui.row(
             ui.card(
-                ui.download_button("download_combgc_table_rows", "Download 'combgc_selected_rows.tsv'", class_="btn btn-info")
+                ui.download_button("download_combgc_table_rows", "Download 'combgc_selected_rows.tsv'", class_="btn btn-info"),
+                ui.input_checkbox("download_gzip", "Compress download (gzip)", value=False)
             )
         ),
-        ui.p("Rows selected by user:", style="font-size: 20px;"),
+        ui.p("Row IDs selected by user (selections are kept across pages and filter changes):", style="font-size: 20px;"),
         ui.output_text("combgc_table_rows", inline=True),
-        ui.output_data_frame("combgc_table_dataframe")
+        paged_table_ui("combgc_table_dataframe", row_selection=True)
     )
 
 
@@ -44,42 +231,25 @@ def combgc_table_server(
     input: Inputs,
     output: Outputs,
     session: Session,
-    df: Callable[[], pd.DataFrame],
+    df: Callable[[], RowView],
     ):
-    selected_rows = reactive.Value([])  # Store selected rows
-    
-    @render.data_frame
-    def combgc_table_dataframe():
-        """"
-        AMPCOMBI: render dataframe in a table
-        """
-        if isinstance(df(), pd.DataFrame):
-            # render grid table
-            data_grid = render.DataGrid(df(),                                           
-                                        row_selection_mode="multiple", 
-                                        width="100%", 
-                                        height="1000px",
-                                        filters=True)
-            return data_grid
-        else:
-            return None
+    selected_row_ids = paged_table_server("combgc_table_dataframe", df=df, row_selection=True)
 
     @output
     @render.text
     def combgc_table_rows():
         """
-        COMbgc: prints the row numbers selected by user
+        COMbgc: prints the row IDs selected by user
         """
-        selected = input.combgc_table_dataframe_selected_rows() or selected_rows.get()
-        l = ", ".join(str(i) for i in selected)
+        l = ", ".join(str(i) for i in selected_row_ids())
         return l
 
     @output
-    @render.download(filename=lambda: "combgc_table_selected_rows.tsv")
+    @render.download(filename=lambda: download_filename("combgc_table_selected_rows.tsv", input.download_gzip()))
     async def download_combgc_table_rows():
-        indices = list(input.combgc_table_dataframe_selected_rows() or selected_rows.get())
-        selected_rows_data = df().iloc[indices]
-        yield selected_rows_data.to_csv(sep="\t", index=False)
+        selected_rows_data = PagedTable(df()).take(selected_row_ids())
+        for chunk in iter_tsv(selected_rows_data, compress=input.download_gzip()):
+            yield chunk
 
 
 
@@ -99,10 +269,11 @@ def combgc_general_statistics_ui():
         ui.p(""),
         ui.row(
             ui.card(
-                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info")
+                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info"),
+                ui.input_checkbox("download_gzip", "Compress download (gzip)", value=False)
             )
         ),
-        ui.output_data_frame("combgc_table"),
+        paged_table_ui("combgc_table"),
     )
 
 
@@ -112,37 +283,45 @@ def combgc_general_statistics_server(
     output: Outputs,
     session: Session,
     df: Callable[[], pd.DataFrame],
+    counts: Callable[[], pd.DataFrame],
+    view: Callable[[], RowView],
+    state: Callable[[], tuple],
     ):
+    # Figures are built in the render pool, see BackgroundFigure
+    venn_figure = BackgroundFigure("venn")
+    boxplot_figure = BackgroundFigure("boxplot")
+
     @output
     @render_widget
+    @timed("venn_diagram")
     def venn_diagram():
-        data = df()  # Reactive data retrieval
-
-        if data is not None and not data.empty:
-            return create_venn(data)
-        return None
+        def build(data):
+            if data is not None and not data.empty:
+                return create_venn_from_counts(data)
+            return None
+        return venn_figure.render(state(), (), counts, build)  # BGC counts of the filtered data
 
     @output
     @render_widget
+    @timed("boxplot")
     def boxplot():
         number_plots = input.boxplot_threshold()  # Get the threshold from the slider
-        data = df()  # Get the filtered data from reactive function
 
-        if data is not None and not data.empty:
-            return boxplot_product_classes(data, number_plots)  # Pass the correct threshold
-        return None
+        def build(data):
+            if data is not None and not data.empty:
+                return boxplot_product_classes(data, number_plots)  # Pass the correct threshold
+            return None
+        return boxplot_figure.render(state(), (number_plots,), df, build)
     
 
-    @render.data_frame
-    def combgc_table():
-        return render.DataTable(df(), width="100%")
+    paged_table_server("combgc_table", df=view)
         
     @render.download(
-    filename=lambda: "combgc_table_filtered.tsv"
+    filename=lambda: download_filename("combgc_table_filtered.tsv", input.download_gzip())
     )
     def download_data():
         filtered_data = df()
-        yield filtered_data.to_csv(sep="\t", index=False)
+        yield from iter_tsv(filtered_data, compress=input.download_gzip())
 
 
 
@@ -159,13 +338,18 @@ def combgc_barplot_ui():
         ui.p(""),
         output_widget("scatter_output"),
         ui.input_slider("scatter_threshold", "Select the minimum amount of bgcs for the product class to be displayed:", min=1, max=50, value=15, step=1),
+        ui.row(
+            ui.column(8, ui.input_selectize("scatter_classes", "Product classes to plot:", choices=[], multiple=True, width="100%")),
+            ui.column(4, ui.input_numeric("scatter_point_budget", "Maximum points per class before binning:", value=SCATTER_POINT_BUDGET, min=1, step=1000)),
+        ),
         ui.p(""),
         ui.row(
             ui.card(
-                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info")
+                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info"),
+                ui.input_checkbox("download_gzip", "Compress download (gzip)", value=False)
             )
         ),
-        ui.output_data_frame("combgc_table")
+        paged_table_ui("combgc_table")
     )
 
 @module.server
@@ -174,35 +358,67 @@ def combgc_barplot_server(
     output: Outputs,
     session: Session,
     df: Callable[[], pd.DataFrame],
+    counts: Callable[[], pd.DataFrame],
+    view: Callable[[], RowView],
+    state: Callable[[], tuple],
     ):
+    # Figures are built in the render pool, see BackgroundFigure
+    barplot_figure = BackgroundFigure("barplot")
+    scatter_figure = BackgroundFigure("scatter")
+
     @output
     @render_widget
+    @timed("barplot_output")
     def barplot_output():
-        data = df()  # Call the reactive function to get the actual DataFrame
-        if data is not None and not data.empty:
-            return stacked_bars_product_classes(data)  # Pass the DataFrame to the plot function
-        return None
+        def build(data):
+            if data is not None and not data.empty:
+                return stacked_bars_product_classes_from_counts(data)
+            return None
+        return barplot_figure.render(state(), (), counts, build)  # BGC counts of the filtered data, answered from the count cube
     
+    @reactive.Calc()
+    @timed("scatter_classes", rows=rows_of(df))
+    def scatter_classes():
+        data = df()
+        if data is None or data.empty:
+            return []
+        return scatter_class_counts(data, input.scatter_threshold()).index.tolist()
+
+    @reactive.Effect
+    def update_scatter_classes():
+        """
+        Offer the classes above the threshold; panels are only built for the selected ones
+        """
+        classes = read_quietly(scatter_classes)
+        with reactive.isolate():
+            selected = [pc for pc in input.scatter_classes() or [] if pc in classes]
+        if not selected:
+            selected = classes[:SCATTER_DEFAULT_PANELS]
+        ui.update_selectize("scatter_classes", choices=classes, selected=selected)
+
     @output
     @render_widget
+    @timed("scatter_output")
     def scatter_output():
         number_plots = input.scatter_threshold()
-        data = df()  # Call the reactive function to get the actual DataFrame
-        if data is not None and not data.empty:
-            return scatter_bgc_contig_classes(data, number_plots)  # Pass the DataFrame to the plot function
-        return None
+        product_classes = tuple(input.scatter_classes() or [])
+        point_budget = input.scatter_point_budget() or SCATTER_POINT_BUDGET
 
+        def build(data):
+            if data is not None and not data.empty:
+                return scatter_bgc_contig_classes(data, number_plots, product_classes=list(product_classes), point_budget=point_budget)
+            return None
+        return scatter_figure.render(state(), (number_plots, product_classes, point_budget), df, build)
 
-    @render.data_frame
-    def combgc_table():
-        return render.DataTable(df(), width="100%")
+
+    paged_table_server("combgc_table", df=view)
         
     @render.download(
-    filename=lambda: "combgc_table_filtered.tsv"
+    filename=lambda: download_filename("combgc_table_filtered.tsv", input.download_gzip())
     )
     def download_data():
         filtered_data = df()
-        yield filtered_data.to_csv(sep="\t", index=False)
+        yield from iter_tsv(filtered_data, compress=input.download_gzip())
 
 
 
@@ -216,10 +432,17 @@ def taxonomy_stacked_bar_ui():
     return ui.nav_panel(
         "Taxonomy Distribution",
         ui.input_select("taxonomy_level", "Select Taxonomy Level:", choices=["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"]),
-        ui.output_ui("taxonomy_options_ui", style="margin-bottom: 5px;"),  # Placeholder for dynamic checkbox options
+        # Searchable selector; options are looked up on the server, so high-cardinality ranks stay fast
+        ui.input_selectize(
+            "taxonomy_options",
+            "Select Specific Taxonomy Options (none selected shows all):",
+            choices=[],
+            multiple=True,
+            width="100%",
+        ),
         ui.input_action_button(
             "toggle_taxonomy_options",
-            "Select/Unselect all",
+            f"Show all / top {TAXONOMY_DEFAULT_OPTIONS}",
             class_="btn btn-outline-dark",
             style="font-size: 12px; padding: 2px 10px; display: inline-block; margin-top: -12px; margin-bottom: 30px;"  # Adjust spacing around button
         ),
@@ -227,105 +450,165 @@ def taxonomy_stacked_bar_ui():
         ui.p(""),
         ui.row(
             ui.card(
-                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info")
+                ui.download_button("download_data", "Download 'combgc_table_filtered.tsv'", class_="btn btn-info"),
+                ui.input_checkbox("download_gzip", "Compress download (gzip)", value=False)
             )
         ),
-        ui.output_data_frame("combgc_table"),
+        paged_table_ui("combgc_table"),
     )
 
 
 @module.server
-def taxonomy_stacked_bar_server(input: Inputs, output: Outputs, session: Session, df: Callable[[], pd.DataFrame]):
-    @output
-    @render_widget
-    def taxonomy_stacked_bar():
-        data = df().copy()
-        if data is not None and not data.empty:
-            if "mmseqs_lineage_contig" in data.columns and data["mmseqs_lineage_contig"].astype(str).eq("nan").all():
-                raise ValueError("Error: No values found in mmseqs_contig_lineage column.")
+def taxonomy_stacked_bar_server(input: Inputs, output: Outputs, session: Session, df: Callable[[], pd.DataFrame], counts: Callable[[], pd.DataFrame], state: Callable[[], tuple]):
+    @reactive.Calc()
+    @timed("taxonomy_names", rows=rows_of(df))
+    def taxonomy_names():
+        """
+        Categorical column of the selected taxonomy level, computed at load; options are its category codes
+        """
+        data = df()
+        taxonomy_level = input.taxonomy_level()
+        if data is None:
+            return None
+        if taxonomy_level not in data.columns:
+            logger.warning("Taxonomy level '%s' not found in data columns.", taxonomy_level)
+            return None
+        return data[taxonomy_level]
 
-            data = preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig")  # Preprocess if not already done
-            taxonomy_level = input.taxonomy_level()
-            selected_options = input.taxonomy_options()  # Get selected options from the checkbox
-            if selected_options:
-                selected_options = [opt.replace("_", " ") for opt in selected_options]
-                data = data[data[taxonomy_level].isin(selected_options)]
+    @reactive.Calc()
+    @timed("taxonomy_choices", rows=rows_of(taxonomy_names))
+    def taxonomy_choices():
+        """
+        Options of the selector as {category code: "name (BGCs)"}, the names with the most BGCs first
+        """
+        names = taxonomy_names()
+        if names is None:
+            return {}
+        categories = names.cat.categories
+        codes = names.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+        present = np.flatnonzero(counts)
+        order = present[np.argsort(-counts[present], kind="stable")]
+        return {str(code): f"{categories[code]} ({counts[code]})" for code in order}
+
+    # Categories the current selection's codes refer to, to reset the selection when they change
+    selection_categories = reactive.Value(None)
+
+    # Options of the previous categories still in the selector until the browser applies the reset
+    stale_options = reactive.Value(None)
+
+    @reactive.Calc()
+    def selected_taxonomy_codes():
+        """
+        Selected options as category codes of the taxonomy level; no selection selects all names.
+        Until the selection has been reset for new categories, the outputs keep showing the previous selection.
+        """
+        names = taxonomy_names()
+        if names is None:
+            return np.zeros(0, dtype=np.int64)
+        options = tuple(input.taxonomy_options() or [])
+        categories = selection_categories.get()
+        if categories is None or not categories.equals(names.cat.categories) or options == stale_options.get():
+            req(False, cancel_output=True)
+        return np.array(sorted(int(code) for code in options), dtype=np.int64)
 
-            
-            return stacked_bars_taxonomy(data, taxonomy_level)
-        return None
+    @reactive.Effect
+    def update_taxonomy_options():
+        """
+        Keep the selected names that are still present; start from the most frequent names at a new level
+        """
+        names = read_quietly(taxonomy_names)
+        choices = read_quietly(taxonomy_choices)
+        categories = None if names is None else names.cat.categories
+        with reactive.isolate():
+            current = input.taxonomy_options() or []
+            previous = selection_categories.get()
+        same_categories = categories is not None and previous is not None and previous.equals(categories)
+        selected = [code for code in current if code in choices] if same_categories else []
+        if not selected and (current or not same_categories):
+            selected = list(choices)[:TAXONOMY_DEFAULT_OPTIONS]
+        if not same_categories and tuple(current) != tuple(selected):
+            stale_options.set(tuple(current))
+        selection_categories.set(categories)
+        ui.update_selectize("taxonomy_options", choices=choices, selected=selected, server=True)
 
+    @reactive.Effect
+    @reactive.event(input.taxonomy_options, ignore_none=False)
+    def clear_stale_options():
+        if tuple(input.taxonomy_options() or []) != stale_options.get():
+            stale_options.set(None)
+
+    @reactive.Calc()
+    @timed("taxonomy_data", rows=rows_of(df))
+    def taxonomy_data():
+        """
+        Rows of the filtered data that belong to the selected taxonomy options
+        """
+        data = df()
+        if data is None or data.empty:
+            return data
+        codes = selected_taxonomy_codes()
+        names = taxonomy_names()
+        if len(codes) and names is not None:
+            # Lookup over the category codes with a trailing False that code -1 (no name) picks
+            selected = np.zeros(len(names.cat.categories) + 1, dtype=bool)
+            selected[codes[codes < len(names.cat.categories)]] = True
+            data = data[selected[names.cat.codes.to_numpy()]]
+        return data
+
+    # The figure is built in the render pool, see BackgroundFigure
+    taxonomy_figure = BackgroundFigure("taxonomy")
 
     @output
-    @render.data_frame
-    def combgc_table():
-        data = df()
-        data = preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig")
+    @render_widget
+    @timed("taxonomy_stacked_bar")
+    def taxonomy_stacked_bar():
+        taxonomy_level = input.taxonomy_level()
+        codes = selected_taxonomy_codes()
+
+        def read():
+            names = taxonomy_names()
+            if names is None or not len(codes):
+                return counts(), None
+            return counts(), names.cat.categories[codes[codes < len(names.cat.categories)]]
+
+        def build(inputs):
+            # BGC counts of the filtered data in the selected taxonomy options; ranks are parsed per lineage
+            data, selected_names = inputs
+            if data is None or data.empty:
+                return None
+            with span("taxonomy.preprocess_taxonomy_column", rows=len(data)):
+                data = preprocess_taxonomy_column(data)
+            if selected_names is not None:
+                data = data[data[taxonomy_level].isin(selected_names)]
+            if data.empty:
+                return None
+            if data["mmseqs_lineage_contig"].eq("").all():
+                raise ValueError("Error: No values found in mmseqs_contig_lineage column.")
+            return stacked_bars_taxonomy_from_counts(data, taxonomy_level)
+        return taxonomy_figure.render(state(), (taxonomy_level, tuple(codes)), read, build)
+
 
-        if data is not None and not data.empty:
-            taxonomy_level = input.taxonomy_level()
-            selected_options = input.taxonomy_options()  # Get selected options from the checkbox
-            if selected_options:
-                selected_options = [opt.replace("_", " ") for opt in selected_options]
-                data = data[data[taxonomy_level].isin(selected_options)]
-        data = data.drop(columns=["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"], errors="ignore")
-        return render.DataTable(data, width="100%")
+    paged_table_server("combgc_table", df=taxonomy_data)
 
 
     @render.download(
-    filename=lambda: "combgc_table_filtered.tsv"
+    filename=lambda: download_filename("combgc_table_filtered.tsv", input.download_gzip())
     )
     def download_data():
-        data = df()
-        data = preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig")
-
-        if data is not None and not data.empty:
-            taxonomy_level = input.taxonomy_level()
-            selected_options = input.taxonomy_options()  # Get selected options from the checkbox
-            if selected_options:
-                data = data[data[taxonomy_level].isin(selected_options)]
-        data = data.drop(columns=["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"], errors="ignore")
-        yield data.to_csv(sep="\t", index=False)
-
-
-    @output
-    @render.ui
-    def taxonomy_options_ui():
-        taxonomy_level = input.taxonomy_level()
-
-        # Get the filtered data and apply the taxonomy preprocessing
-        data = df()
-        data = preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig")
+        data = taxonomy_data()
+        yield from iter_tsv(data, compress=input.download_gzip())
 
-        if data is not None and taxonomy_level in data.columns:
-            unique_values = sorted(data[taxonomy_level].dropna().unique())
-            return ui.input_checkbox_group("taxonomy_options", "Select Specific Taxonomy Options:", choices=unique_values, selected=unique_values)
-        else:
-            print(f"Warning: Taxonomy level '{taxonomy_level}' not found in data columns.")
-        
-        # Default empty checkbox if no data or column is available
-        return ui.input_checkbox_group("taxonomy_options", "Select Specific Taxonomy Options:", choices=[])
-    
 
     @reactive.Effect
     @reactive.event(input.toggle_taxonomy_options)
     def on_toggle_taxonomy_options():
-        taxonomy_level = input.taxonomy_level()
-        current_selection = input.taxonomy_options() or []
-
-        # Get the filtered data and apply the taxonomy preprocessing
-        data = df()
-        data = preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig")
-
-        if data is not None and taxonomy_level in data.columns:
-            unique_values = sorted(data[taxonomy_level].dropna().unique())
-
-            # Toggle selection based on the current state
-            if set(current_selection) == set(unique_values):
-                new_selection = [] # If all are selected, unselect all
-            else:
-                new_selection = unique_values # Otherwise, select all
-            session.send_input_message("taxonomy_options", {"value": new_selection})
+        # Toggle between all names (no selection) and the most frequent ones, from the cached choices
+        if input.taxonomy_options():
+            new_selection = []
+        else:
+            new_selection = list(read_quietly(taxonomy_choices))[:TAXONOMY_DEFAULT_OPTIONS]
+        ui.update_selectize("taxonomy_options", selected=new_selection)
 
 
 
@@ -339,13 +622,14 @@ def combgc_taxonomy_ui():
                 ui.p(
                     {"style": "font-size: 20px;"},
                     """
-                    Enter cluster ID here to filter plot
+                    Enter a BGC row ID (as shown in the tables) here to filter plot
                     """
                     ),
                 ui.input_numeric("clusters_id_tax", "", value=None),
+                ui.input_numeric("sankey_top_n", "Maximum taxa per rank (others are merged into 'Other'):", value=SANKEY_TOP_N, min=1, step=1),
                 output_widget("combgc_sankey_plot"), 
                 {"style": "font-size: 15px;"},
-                "The sankey plot showing the taxonomic lineage is rendered in a new tab in which the user can interactively adjust.", 
+                "The sankey plot shows the taxonomic lineage of the contigs of the filtered BGCs.", 
     )
 
 @module.server
@@ -354,54 +638,259 @@ def combgc_taxonomy_server(
     output: Outputs,
     session: Session,
     df: Callable[[], pd.DataFrame],
+    state: Callable[[], tuple],
 ):
+    # The figure is built in the render pool, see BackgroundFigure
+    sankey_figure = BackgroundFigure("sankey")
+
     @output
     @render_widget
+    @timed("combgc_sankey_plot")
     def combgc_sankey_plot():
-        data = df()
-        if data is not None and not data.empty:
-            # Check if the mmseqs_contig_lineage column exists and has only NaN values
-            if "mmseqs_lineage_contig" in data.columns and data["mmseqs_lineage_contig"].astype(str).eq("nan").all():
-                raise ValueError("Error: No values found in mmseqs_contig_lineage column.")
-            return plot_combgc_sankey(data)
-        return None
+        row_id = input.clusters_id_tax()
+        top_n = input.sankey_top_n() or SANKEY_TOP_N
+
+        def build(data):
+            if data is not None and not data.empty:
+                if row_id is not None:
+                    data = data[data.index == row_id]
+                    if data.empty:
+                        raise ValueError(f"Error: No BGC with row ID {row_id} in the filtered data.")
+                # Check if the mmseqs_contig_lineage column exists and has only NaN values
+                if "mmseqs_lineage_contig" in data.columns and data["mmseqs_lineage_contig"].eq("").all():
+                    raise ValueError("Error: No values found in mmseqs_contig_lineage column.")
+                return plot_combgc_sankey(data, top_n=top_n)
+            return None
+        return sankey_figure.render(state(), (row_id, top_n), df, build)
+
+
+
+
+
+
+###########################################
+#      REGION QUERY
+###########################################
+# Overlapping pairs shown in the region query tab; all pairs are in the download
+OVERLAP_DISPLAY_ROWS = 1000
+
+
+@module.ui
+def region_query_ui():
+    return ui.nav_panel(
+        "Region Query",
+        ui.p("BGCs of the filtered data that overlap a contig region:", style="font-size: 20px;"),
+        ui.row(
+            ui.column(3, ui.input_selectize("sample", "Sample:", choices=[])),
+            ui.column(3, ui.input_selectize("contig", "Contig:", choices=[])),
+            ui.column(3, ui.input_numeric("region_start", "Start:", value=1, min=0, step=1)),
+            ui.column(3, ui.input_numeric("region_end", "End:", value=1000000, min=0, step=1)),
+        ),
+        paged_table_ui("region_table"),
+        ui.p(""),
+        ui.p("Pairs of overlapping BGCs on the same contig:", style="font-size: 20px;"),
+        ui.row(
+            ui.column(3, ui.input_numeric("min_overlap", "Minimum overlap (bp):", value=1, min=1, step=100)),
+            ui.column(4, ui.input_checkbox("different_tools", "Only pairs without a prediction tool in common", value=True)),
+            ui.column(5, ui.input_action_button("run_overlap_join", "Find overlapping BGCs", class_="btn btn-outline-dark")),
+        ),
+        ui.output_text("overlap_info"),
+        ui.output_data_frame("overlap_table"),
+        ui.row(
+            ui.card(
+                ui.download_button("download_overlaps", "Download 'combgc_overlapping_bgcs.tsv'", class_="btn btn-info"),
+                ui.input_checkbox("download_gzip", "Compress download (gzip)", value=False)
+            )
+        ),
+    )
 
 
+@module.server
+def region_query_server(
+    input: Inputs,
+    output: Outputs,
+    session: Session,
+    dataset: Callable[[], ComBGCDataset],
+    view: Callable[[], RowView],
+    ):
+    @reactive.Effect
+    def update_samples():
+        def samples_of_view():
+            data = view()
+            return [] if data is None else sorted(data.table["sample_id"].iloc[data.rows].dropna().unique())
+
+        samples = read_quietly(samples_of_view)
+        with reactive.isolate():
+            selected = input.sample() if input.sample() in samples else (samples[0] if samples else None)
+        ui.update_selectize("sample", choices=samples, selected=selected, server=True)
+
+    @reactive.Effect
+    def update_contigs():
+        data = read_quietly(dataset)
+        if data is None or not input.sample():
+            return
+        ui.update_selectize("contig", choices=data.intervals.contigs(input.sample()), server=True)
+
+    @reactive.Calc()
+    @timed("region_rows", rows=rows_of(view))
+    def region_rows():
+        """
+        BGCs overlapping the region, looked up in the interval index and kept if they pass the filters
+        """
+        data = view()
+        if data is None or not input.sample() or not input.contig():
+            return None
+        if len(data) == 0:
+            return RowView(data.table, np.zeros(0, dtype=np.int64))
+        start = input.region_start() or 0
+        end = input.region_end() if input.region_end() is not None else start
+        hits = dataset().intervals.query(input.sample(), input.contig(), start, end)
+        if len(hits) == 0:
+            return RowView(data.table, np.zeros(0, dtype=np.int64))
+        return RowView(data.table, np.sort(hits[data.contains(hits)]))
+
+    paged_table_server("region_table", df=region_rows)
+
+    @reactive.Calc()
+    @reactive.event(input.run_overlap_join)
+    @timed("overlaps", rows=rows_of(view))
+    def overlaps():
+        data = view()
+        if data is None:
+            return None
+        pairs = dataset().intervals.overlap_join(data.rows, data.rows, min_overlap=input.min_overlap() or 1)
+        pairs = pairs[pairs["row_id"] < pairs["other_row_id"]]  # each pair once
+        if input.different_tools():
+            codes = tool_codes(data.table)
+            pairs = pairs[(codes[pairs["row_id"]] & codes[pairs["other_row_id"]]) == 0]
+        return overlap_frame(data.table, pairs)
+
+    @output
+    @render.text
+    def overlap_info():
+        pairs = overlaps()
+        if pairs is None:
+            return ""
+        return f"{len(pairs)} overlapping pairs, showing the first {min(len(pairs), OVERLAP_DISPLAY_ROWS)}"
 
+    @render.data_frame
+    def overlap_table():
+        pairs = overlaps()
+        if pairs is None:
+            return None
+        return render.DataGrid(display_frame(pairs.head(OVERLAP_DISPLAY_ROWS)), width="100%", height="600px")
 
+    @render.download(
+    filename=lambda: download_filename("combgc_overlapping_bgcs.tsv", input.download_gzip())
+    )
+    def download_overlaps():
+        pairs = overlaps()
+        if pairs is not None:
+            yield from iter_tsv(pairs, compress=input.download_gzip())
+
+
+def overlap_frame(table, pairs):
+    """
+    Overlap join pairs with the location and tools of both BGCs.
+    """
+    columns = ["sample_id", "contig_id", "BGC_start", "BGC_end", "Tool_representative"]
+    left = table[columns].iloc[pairs["row_id"].to_numpy()].reset_index(drop=True)
+    right = table[columns[2:]].iloc[pairs["other_row_id"].to_numpy()].reset_index(drop=True)
+    return pd.concat([
+        pairs.reset_index(drop=True).rename(columns={"overlap": "overlap_bp"}),
+        left,
+        right.add_prefix("other_"),
+    ], axis=1)
 
 
 ###########################################
 #      FILTER DATA
 ###########################################
-def filter_data(df, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected, selected_product_classes, bgc_length_min, bgc_length_max):
-    # Initialize a base mask with False values, aligned with the DataFrame index
-    base_mask = pd.Series([False] * len(df), index=df.index)
-    
-    # Apply all_selected condition first
-    if all_selected:
-        base_mask |= (df["deepBGC"] == "Yes") & (df["GECCO"] == "Yes") & (df["antiSMASH"] == "Yes")
-    else:
-        # Apply individual selection criteria
-        if deepBGC_selected:
-            base_mask |= (df["deepBGC"] == "Yes")
-        if GECCO_selected:
-            base_mask |= (df["GECCO"] == "Yes")
-        if antiSMASH_selected:
-            base_mask |= (df["antiSMASH"] == "Yes")
-
-    # Product class filtering - create a boolean mask based on selected product classes
-    if selected_product_classes:
-        class_mask = df["Product_class"].apply(lambda x: any(item in selected_product_classes for item in x.split(", ")) if pd.notna(x) else False)
-        class_mask = class_mask.astype(bool)  # Ensure mask is strictly boolean
-        base_mask &= class_mask
-    
-    # Convert BGC_length to numeric and filter by min and max values
-    length_mask = (df["BGC_length"] >= bgc_length_min) & (df["BGC_length"] <= bgc_length_max)
-    length_mask = length_mask.fillna(False).astype(bool)  # Ensure no NaN values, strictly boolean
-    base_mask &= length_mask
+def filter_data(dataset, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected, selected_product_classes, bgc_length_min, bgc_length_max):
+    df = dataset.table
+    base_mask = tool_mask(dataset, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected)
+    base_mask &= product_class_mask(dataset, selected_product_classes)
+    base_mask &= length_mask(dataset, bgc_length_min, bgc_length_max)
 
     # Return filtered DataFrame
     return df[base_mask]
 
 
+# One mask per sidebar criterion, so each can be cached and recomputed only when its own input changes
+def tool_mask(dataset, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected):
+    # Tool selection - look up every BGC's tool code in the table of accepted codes
+    selected_tools = [tool for tool, selected in zip(TOOL_COLUMNS, [deepBGC_selected, GECCO_selected, antiSMASH_selected]) if selected]
+    return tool_code_lookup(selected_tools, all_selected)[tool_codes(dataset.table)]
+
+
+def product_class_mask(dataset, selected_product_classes):
+    # Product class filtering - OR of the selected columns of the product class index
+    if not selected_product_classes:
+        return np.ones(len(dataset), dtype=bool)
+    return dataset.product_classes.mask(selected_product_classes)
+
+
+def length_mask(dataset, bgc_length_min, bgc_length_max):
+    # Two binary searches in the length index; BGCs without a length never match
+    return dataset.lengths.mask(bgc_length_min, bgc_length_max)
+
+
+def filter_state(dataset, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected, selected_product_classes, bgc_length_min, bgc_length_max):
+    """
+    Hashable description of the filtered data: the dataset fingerprint and the normalized sidebar filters.
+    Selections that filter the same rows map to the same state, e.g. product classes picked in another order.
+    """
+    tools = ("Shared by All",) if all_selected else tuple(
+        tool for tool, selected in zip(TOOL_COLUMNS, [deepBGC_selected, GECCO_selected, antiSMASH_selected]) if selected
+    )
+    classes = tuple(sorted(set(selected_product_classes)))
+    return (dataset.fingerprint, tools, classes, float(bgc_length_min), float(bgc_length_max))
+
+
+def filter_counts(dataset, deepBGC_selected, GECCO_selected, antiSMASH_selected, all_selected, selected_product_classes, bgc_length_min, bgc_length_max):
+    """
+    BGC counts of the rows filter_data would return, answered as a slice of the dataset's count cube.
+    """
+    selected_tools = [tool for tool, selected in zip(TOOL_COLUMNS, [deepBGC_selected, GECCO_selected, antiSMASH_selected]) if selected]
+    class_mask = dataset.product_classes.value_mask(selected_product_classes) if selected_product_classes else None
+    return dataset.counts.slice(tool_code_lookup(selected_tools, all_selected), class_mask, bgc_length_min, bgc_length_max)
+
+
+###########################################
+#      DIAGNOSTICS
+###########################################
+# Seconds between refreshes of the diagnostics tab
+DIAGNOSTICS_REFRESH_SECONDS = 2
+
+
+@module.ui
+def diagnostics_ui():
+    return ui.nav_panel(
+        "Diagnostics",
+        ui.p("Timings of the calcs, renders and figure builds of all sessions served by this process, most total time first."),
+        ui.output_text("figure_cache_info"),
+        ui.output_data_frame("node_stats"),
+        ui.download_button("download_events", "Download recent events (JSONL)", class_="btn btn-info"),
+    )
+
+
+@module.server
+def diagnostics_server(input: Inputs, output: Outputs, session: Session):
+    @output
+    @render.text
+    def figure_cache_info():
+        reactive.invalidate_later(DIAGNOSTICS_REFRESH_SECONDS)
+        stats = figure_cache.stats()
+        return (
+            f"Figure cache: {stats['entries']} figures, {stats['bytes'] / 1024 ** 2:.1f} of {stats['max_bytes'] / 1024 ** 2:.0f} MiB, "
+            f"hit rate {stats['hit_rate']:.0%}, {stats['evictions']} evictions"
+        )
+
+    @render.data_frame
+    def node_stats():
+        reactive.invalidate_later(DIAGNOSTICS_REFRESH_SECONDS)
+        return render.DataGrid(instrumentation.stats().round(4), width="100%", height="600px")
+
+    @render.download(filename="combgc_instrumentation.jsonl")
+    def download_events():
+        yield from instrumentation.iter_jsonl()
@@ -3,36 +3,125 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import colorsys
+import numpy as np
 
-import re
+from background import checkpoint
+from loader import TAXONOMY_LEVELS, add_taxonomy_columns, tool_code_counts, tool_codes, contig_lengths
 
 
 
 ###########################################
 #       BOXPLOT
 ############################################
-##### Plots all product classes ######
-def boxplot_product_classes(table, number_plots):
-    filtered_bgcs = table
-    
-    # Keep the full product class entries without splitting them
-    filtered_bgcs["Product_class"] = filtered_bgcs["Product_class"].apply(lambda x: x.strip())
-    
+# Maximum number of outliers drawn per product class in the precomputed box plot
+BOXPLOT_OUTLIER_SAMPLE = 200
+
+
+def box_statistics(table, number_plots, outlier_sample=BOXPLOT_OUTLIER_SAMPLE):
+    """
+    Quartiles and Tukey whiskers of BGC_length per product class with more than `number_plots` BGCs,
+    ordered by class count. Also returns up to `outlier_sample` randomly drawn outliers per class.
+    """
+    filtered_bgcs = table[["sample_id", "contig_id", "Product_class", "BGC_length"]]
+    filtered_bgcs = filtered_bgcs.assign(Product_class=filtered_bgcs["Product_class"].astype("category"))
+
     # Filter out classes that have less count than `number_plots`
     class_counts = filtered_bgcs["Product_class"].value_counts()
+    class_counts = class_counts[class_counts > number_plots].sort_values(ascending=False)
+    filtered_bgcs = filtered_bgcs[filtered_bgcs["Product_class"].isin(class_counts.index)]
+
+    lengths = filtered_bgcs.groupby("Product_class", observed=True)["BGC_length"]
+    stats = lengths.quantile([0.25, 0.5, 0.75]).unstack().reindex(columns=[0.25, 0.5, 0.75])
+    stats.columns = ["q1", "median", "q3"]
+    stats = stats.reindex(class_counts.index)
+    stats["count"] = class_counts
+
+    # Whiskers end at the most extreme BGC within 1.5 IQR of the box
+    iqr = stats["q3"] - stats["q1"]
+    categories = filtered_bgcs["Product_class"].cat.categories
+    codes = filtered_bgcs["Product_class"].cat.codes.to_numpy()
+    lower_bound = (stats["q1"] - 1.5 * iqr).reindex(categories).to_numpy()[codes]
+    upper_bound = (stats["q3"] + 1.5 * iqr).reindex(categories).to_numpy()[codes]
+    values = filtered_bgcs["BGC_length"].to_numpy()
+    inside = (values >= lower_bound) & (values <= upper_bound)
+
+    within = filtered_bgcs[inside].groupby("Product_class", observed=True)["BGC_length"]
+    stats["lowerfence"] = within.min()
+    stats["upperfence"] = within.max()
+
+    outliers = filtered_bgcs[~inside].sample(frac=1, random_state=0)
+    outliers = outliers.groupby("Product_class", observed=True).head(outlier_sample)
+    return stats, outliers
+
+
+##### Plots all product classes ######
+def boxplot_product_classes(table, number_plots, precomputed=True, outlier_sample=BOXPLOT_OUTLIER_SAMPLE):
+    """
+    Box plot of BGC length per product class. With `precomputed` the quartiles are computed here and
+    only the per-class statistics plus a sample of outliers are sent to Plotly; otherwise every BGC is sent.
+    The input table is not modified.
+    """
+    title = "BGC Length by Product Class (log scale)"
+    if not precomputed:
+        return boxplot_product_classes_raw(table, number_plots, title)
+
+    stats, outliers = box_statistics(table, number_plots, outlier_sample)
+    class_order = stats.index.tolist()
+    checkpoint()
+
+    fig = go.Figure()
+    fig.add_trace(go.Box(
+        x=class_order,
+        q1=stats["q1"],
+        median=stats["median"],
+        q3=stats["q3"],
+        lowerfence=stats["lowerfence"],
+        upperfence=stats["upperfence"],
+        boxpoints=False,
+        name="BGC length",
+        marker_color="#636efa",
+    ))
+    fig.add_trace(go.Scatter(
+        x=outliers["Product_class"].astype(str),
+        y=outliers["BGC_length"],
+        mode="markers",
+        name="Outliers",
+        marker=dict(color="#636efa", size=4),
+        customdata=outliers[["sample_id", "contig_id"]].astype(str),
+        hovertemplate="Product Class: %{x}<br>BGC Length: %{y}<br>sample_id: %{customdata[0]}<br>contig_id: %{customdata[1]}<extra></extra>",
+    ))
+
+    # Add log scale and sort by class count
+    checkpoint()
+    fig.update_layout(
+        title=title,
+        showlegend=False,
+        xaxis_title="Product Class",
+        yaxis_title="BGC Length [bp]",
+        yaxis_type="log",
+        xaxis={"categoryorder": "array", "categoryarray": class_order},
+    )
+    fig.update_xaxes(tickangle=-35)
+
+    return fig
+
+
+def boxplot_product_classes_raw(table, number_plots, title):
+    # Filter out classes that have less count than `number_plots`
+    class_counts = table["Product_class"].value_counts()
     valid_classes = class_counts[class_counts > number_plots].index
     
     # Define ascending order for product classes
     class_order = class_counts.loc[valid_classes].sort_values(ascending=False).index
     
     # Filter the DataFrame based on valid product classes
-    filtered_bgcs = filtered_bgcs[filtered_bgcs["Product_class"].isin(valid_classes)]
+    filtered_bgcs = table[table["Product_class"].isin(valid_classes)]
     
     # Create the boxplot using Plotly
     fig = px.box(filtered_bgcs, 
                  x="Product_class", 
                  y="BGC_length", 
-                 title="BGC Length by Product Class (log scale)",
+                 title=title,
                  labels={"Product_class": "Product Class", "BGC_length": "BGC Length [bp]"},
                  hover_data=["sample_id", "contig_id"])
 
@@ -50,25 +139,43 @@ def boxplot_product_classes(table, number_plots):
 ###########################################
 #       STACKED BARS
 ###########################################
+def count_rows(table, columns):
+    """
+    BGC counts per combination of `columns` in the layout of dataset.CountCube.slice,
+    for plotting row-level tables with the *_from_counts functions.
+    """
+    if "tool_code" in columns and "tool_code" not in table.columns:
+        table = table.assign(tool_code=tool_codes(table))
+    return table.groupby(columns, observed=True, sort=False).size().reset_index(name="count")
+
+
 def stacked_bars_product_classes(table):
-    filtered_bgcs = table.copy()
-    filtered_bgcs["sample_id"] = filtered_bgcs["sample_id"].str.split("-").str[0]
-    filtered_bgcs["sample_name"] = filtered_bgcs["sample_id"].str.split("_").str[0]
+    return stacked_bars_product_classes_from_counts(count_rows(table, ["sample_id", "Product_class"]))
 
-    product_class_counts = filtered_bgcs.groupby(["sample_name", "Product_class"]).size().unstack(fill_value=0).reset_index()
 
+def stacked_bars_product_classes_from_counts(counts):
+    """
+    Stacked bars of BGC counts per sample and Product_class, from a frame with a "count" column.
+    Sample names are derived once per distinct sample_id and only non-empty bars are drawn.
+    """
+    sample_ids = counts["sample_id"].astype("category")
+    names = sample_ids.cat.categories.str.split("-").str[0].str.split("_").str[0]
+    counts = counts.assign(sample_name=np.append(names, None)[sample_ids.cat.codes.to_numpy()])
 
-    # Melt the dataframe to long format 
-    product_class_counts_melted = product_class_counts.melt(id_vars="sample_name", var_name="First_Product_class", value_name="Count")
+    product_class_counts = counts.groupby(["sample_name", "Product_class"], observed=True)["count"].sum().reset_index(name="Count")
+    product_class_counts = product_class_counts[product_class_counts["Count"] > 0]
+    product_class_counts = product_class_counts.rename(columns={"Product_class": "First_Product_class"})
+    checkpoint()
 
-    
-    fig = px.bar(product_class_counts_melted, 
+    fig = px.bar(product_class_counts, 
                  x="sample_name", 
                  y="Count", 
                  color="First_Product_class", 
                  title="Stacked Bar Plot of Product Class Counts per Sample",
                  labels={"sample_name": "Sample", "Count": "Count"},
+                 category_orders={"sample_name": sorted(product_class_counts["sample_name"].unique())},
                  barmode="stack")
+    checkpoint()
     
     fig.update_layout(
         width=1200,
@@ -85,39 +192,76 @@ def stacked_bars_product_classes(table):
 #      SCATTER PLOT
 ###########################################
 
-def scatter_bgc_contig_classes(table, number_plots):
-    import re
-    import plotly.graph_objects as go
-    from plotly.subplots import make_subplots
+# Panels with more BGCs than this are drawn as a binned density instead of individual points
+SCATTER_POINT_BUDGET = 20000
+# Number of bins per axis of the density panels
+SCATTER_DENSITY_BINS = 80
 
-    # Make a copy of the input table
-    filtered_bgcs = table.copy()
-    
-    # Extract contig length from the contig_id column
-    filtered_bgcs['contig_length'] = filtered_bgcs['contig_id'].apply(lambda x: int(re.search(r'length_(\d+)', x).group(1)))
-    
-    # Clean and filter the product classes
-    filtered_bgcs["Product_class"] = filtered_bgcs["Product_class"].apply(lambda x: x.strip())
-    class_counts = filtered_bgcs["Product_class"].value_counts()
-    valid_classes = class_counts[class_counts >= number_plots].index
-    class_order = class_counts.loc[valid_classes].sort_values(ascending=False).index
-    filtered_bgcs = filtered_bgcs[filtered_bgcs["Product_class"].isin(valid_classes)]
+
+def scatter_class_counts(table, number_plots):
+    """
+    Number of BGCs per product class for the classes with at least `number_plots` BGCs, largest first.
+    """
+    class_counts = table["Product_class"].value_counts()
+    return class_counts[class_counts >= number_plots].sort_values(ascending=False)
+
+
+def scatter_density_trace(x, y, name, bins=SCATTER_DENSITY_BINS):
+    """
+    Bin the points server-side into a heatmap, so the payload is bins x bins whatever the number of BGCs.
+    """
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    counts = np.where(counts > 0, counts, np.nan).T  # empty bins stay transparent
+    return go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=counts,
+        name=name,
+        colorscale="Viridis",
+        showscale=False,
+        hovertemplate="Contig Length: %{x:.0f}<br>BGC Length: %{y:.0f}<br>BGCs: %{z}<extra></extra>"
+    )
+
+
+def scatter_bgc_contig_classes(table, number_plots, product_classes=None, point_budget=SCATTER_POINT_BUDGET):
+    """
+    BGC length vs. contig length, one panel per product class with at least `number_plots` BGCs.
+    Only the panels of `product_classes` are built (all when None). Panels are drawn with WebGL and
+    fall back to a 2-D histogram when they hold more than `point_budget` BGCs.
+    """
+    # Contig length is extracted at load, BGCs on contigs without a length are not plotted
+    filtered_bgcs = table[["sample_id", "contig_id", "Product_class", "BGC_length"]].assign(contig_length=contig_lengths(table))
+    filtered_bgcs = filtered_bgcs[filtered_bgcs['contig_length'].notna()]
     
-    # Use the sorted product classes for plotting
-    product_classes = class_order
+    # Use the product classes sorted by count for plotting
+    class_order = scatter_class_counts(filtered_bgcs, number_plots).index
+    if product_classes is not None:
+        class_order = [pc for pc in class_order if pc in product_classes]
+    title_text = "BGC Length vs. Contig Length for Each Product Class"
+    if len(class_order) == 0:
+        return go.Figure(layout=dict(title_text=title_text))
+    checkpoint()
     
     # Create a subplot figure
     fig = make_subplots(
-        rows=len(product_classes), 
+        rows=len(class_order), 
         cols=1, 
-        subplot_titles=[f"Product Class: {pc}" for pc in product_classes]
+        subplot_titles=[f"Product Class: {pc}" for pc in class_order]
     )
 
-    for i, product_class in enumerate(product_classes, 1):
-        subset = filtered_bgcs[filtered_bgcs['Product_class'] == product_class]
-        scatter = go.Scatter(
-            x=subset['contig_length'], 
-            y=subset['BGC_length'], 
+    groups = filtered_bgcs.groupby("Product_class", observed=True)
+    for i, product_class in enumerate(class_order, 1):
+        checkpoint()
+        subset = groups.get_group(product_class)
+        x = subset['contig_length'].to_numpy(dtype="int64")
+        y = subset['BGC_length'].to_numpy()
+        if len(subset) > point_budget:
+            fig.add_trace(scatter_density_trace(x, y, product_class), row=i, col=1)
+            continue
+
+        scatter = go.Scattergl(
+            x=x, 
+            y=y, 
             mode='markers', 
             name=product_class,
             text=subset['sample_id'],  # Assign sample_id to hover text
@@ -128,17 +272,18 @@ def scatter_bgc_contig_classes(table, number_plots):
         
         # Adjust axes for single data points
         if len(subset) == 1:
-            single_x = subset['contig_length'].iloc[0]
-            single_y = subset['BGC_length'].iloc[0]
+            single_x = x[0]
+            single_y = y[0]
             x_range = [single_x - 0.5 * single_x, single_x + 0.5 * single_x]  # Adjust range by +/- 50%
             y_range = [single_y - 0.5 * single_y, single_y + 0.5 * single_y]
             fig.update_xaxes(range=x_range, row=i, col=1)
             fig.update_yaxes(range=y_range, row=i, col=1)
 
     # Update layout
+    checkpoint()
     fig.update_layout(
-        height=250 * len(product_classes),  # Adjust height based on the number of classes
-        title_text="BGC Length vs. Contig Length for Each Product Class",
+        height=250 * len(class_order),  # Adjust height based on the number of classes
+        title_text=title_text,
         showlegend=False,
         margin=dict(t=100),
         xaxis_title="Contig Length [bp]", 
@@ -153,46 +298,27 @@ def scatter_bgc_contig_classes(table, number_plots):
 ###########################################
 
 def create_venn(table):
-    filtered_bgcs = table
+    return create_venn_from_counts(count_rows(table, ["tool_code"]))
+
+
+def create_venn_from_counts(counts):
     fig = go.Figure()
 
-    # Count occurrences based on the specified conditions
-    counts = {
-        "deepbgc_count": ((filtered_bgcs["deepBGC"] == "Yes") & 
-                        (filtered_bgcs["GECCO"].isnull()) & 
-                        (filtered_bgcs["antiSMASH"].isnull())).sum(),
-        "gecco_count": ((filtered_bgcs["deepBGC"].isnull()) & 
-                        (filtered_bgcs["GECCO"] == "Yes") & 
-                        (filtered_bgcs["antiSMASH"].isnull())).sum(),
-        "antismash_count": ((filtered_bgcs["deepBGC"].isnull()) & 
-                            (filtered_bgcs["GECCO"].isnull()) & 
-                            (filtered_bgcs["antiSMASH"] == "Yes")).sum(),
-        "deepbgc_gecco_count": ((filtered_bgcs["deepBGC"] == "Yes") & 
-                                (filtered_bgcs["GECCO"] == "Yes") & 
-                                (filtered_bgcs["antiSMASH"].isnull())).sum(),
-        "deepbgc_antismash_count": ((filtered_bgcs["deepBGC"] == "Yes") & 
-                                    (filtered_bgcs["GECCO"].isnull()) & 
-                                    (filtered_bgcs["antiSMASH"] == "Yes")).sum(),
-        "antismash_gecco_count": ((filtered_bgcs["deepBGC"].isnull()) & 
-                                (filtered_bgcs["GECCO"] == "Yes") & 
-                                (filtered_bgcs["antiSMASH"] == "Yes")).sum(),
-        "all_count": ((filtered_bgcs["antiSMASH"] == "Yes") & 
-                    (filtered_bgcs["deepBGC"] == "Yes") & 
-                    (filtered_bgcs["GECCO"] == "Yes")).sum()
-    }
+    # Sum BGCs per tool code; bits: deepBGC = 1, GECCO = 2, antiSMASH = 4
+    counts = tool_code_counts(counts["tool_code"].to_numpy(), weights=counts["count"].to_numpy())
 
     # Create scatter trace of text labels with values
     fig.add_trace(go.Scatter(
         x=[0.45, 2.55, 1.5, 1.5, 2.25, 0.75, 1.5, 1.5, -0.1, 3.1],
         y=[0.6 , 0.6 , 2.5, 0.5, 1.75, 1.75, 1.35, 3.1, 0.25, 0.25],
         text=[
-            f"\n{counts["deepbgc_count"]}",                   # Left circle only (deepBGC)
-            f"\n{counts["antismash_count"]}",                 # Right circle only (antiSMASH)
-            f"\n{counts["gecco_count"]}",                     # Top circle only (GECCO)
-            f"\n{counts["deepbgc_antismash_count"]}",           # deepBGC & antiSMASH
-            f"\n{counts["antismash_gecco_count"]}",             # antiSMASH & GECCO
-            f"\n{counts["deepbgc_gecco_count"]}",               # deepBGC & GECCO
-            f"\n{counts["all_count"]}",                       # all three
+            f"\n{counts[1]}",                   # Left circle only (deepBGC)
+            f"\n{counts[4]}",                   # Right circle only (antiSMASH)
+            f"\n{counts[2]}",                   # Top circle only (GECCO)
+            f"\n{counts[5]}",                   # deepBGC & antiSMASH
+            f"\n{counts[6]}",                   # antiSMASH & GECCO
+            f"\n{counts[3]}",                   # deepBGC & GECCO
+            f"\n{counts[7]}",                   # all three
             f"GECCO",
             f"deepBGC",
             f"antiSMASH"
@@ -264,29 +390,13 @@ def create_venn(table):
 ###########################################
 
 def preprocess_taxonomy_column(data, column_name="mmseqs_lineage_contig"):
-    data = data.copy()
-    taxonomy_columns = ["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"]
-
-    # Remove any existing taxonomy columns to prevent duplication
-    existing_columns = [col for col in taxonomy_columns if col in data.columns]
-    if existing_columns:
-        data = data.drop(columns=existing_columns)
-
-    taxonomy_data = data[column_name].str.split(";", expand=True)
-    # Assign column names only up to the number of columns in `taxonomy_data`
-    taxonomy_data.columns = taxonomy_columns[:taxonomy_data.shape[1]]
-
-    for col in taxonomy_data.columns:
-        taxonomy_data[col] = taxonomy_data[col].str.split("_").str[1]
-
-    # Ensure all taxonomy columns are present by adding missing ones with None
-    for col in taxonomy_columns:
-        if col not in taxonomy_data.columns:
-            taxonomy_data[col] = None
-    # Concatenate the new taxonomy columns with the original dataframe
-    data = pd.concat([data, taxonomy_data[taxonomy_columns]], axis=1)
-    
-    return data
+    """
+    Return `data` with one column per taxonomic rank. Tables read through loader.read_combgc_table
+    already carry these columns, in which case nothing is parsed or copied.
+    """
+    if all(level in data.columns for level in TAXONOMY_LEVELS):
+        return data
+    return add_taxonomy_columns(data.copy(), column_name=column_name)
 
 def stacked_bars_taxonomy(data, taxonomy_level):
     """
@@ -294,10 +404,22 @@ def stacked_bars_taxonomy(data, taxonomy_level):
     """
     if taxonomy_level not in data.columns:
         raise ValueError(f"Taxonomy level '{taxonomy_level}' not found in the data columns.")
-    
-    data_copy = data.copy()
-    data_copy["sample_id"] = data_copy["sample_id"].str.split("-").str[0]
-    grouped_data = data_copy.groupby(["sample_id", taxonomy_level]).size().reset_index(name="Count")
+    return stacked_bars_taxonomy_from_counts(count_rows(data, ["sample_id", taxonomy_level]), taxonomy_level)
+
+
+def stacked_bars_taxonomy_from_counts(counts, taxonomy_level):
+    """
+    Stacked bars of BGC counts per sample and name at `taxonomy_level`, from a frame with a "count" column.
+    """
+    if taxonomy_level not in counts.columns:
+        raise ValueError(f"Taxonomy level '{taxonomy_level}' not found in the data columns.")
+
+    sample_ids = counts["sample_id"].astype("category")
+    names = sample_ids.cat.categories.str.split("-").str[0]
+    counts = counts.assign(sample_id=np.append(names, None)[sample_ids.cat.codes.to_numpy()])
+    grouped_data = counts.groupby(["sample_id", taxonomy_level], observed=True)["count"].sum().reset_index(name="Count")
+    grouped_data = grouped_data[grouped_data["Count"] > 0]
+    checkpoint()
 
     fig = px.bar(
         grouped_data,
@@ -306,6 +428,7 @@ def stacked_bars_taxonomy(data, taxonomy_level):
         color=taxonomy_level,
         title=f"Stacked Bar Plot for Taxonomy Level: {taxonomy_level}"
     )    
+    checkpoint()
     fig.update_layout(
         width=1000,  # Set the width (in pixels)
         height=800  # Set the height (in pixels)
@@ -318,221 +441,105 @@ def stacked_bars_taxonomy(data, taxonomy_level):
 
 
 
-def plot_combgc_sankey(filtered):
-    # set up data and layout required by sankey plots
-    data = [
-        {
-        "type": "sankey", 
-        "domain": {"x": [0, 1], "y": [0, 1]}, 
-        "orientation": "h", 
-        "valueformat": ".0f", 
-        "valuesuffix": "TWh", 
-        "node": {
-            "pad": 15, 
-            "thickness": 15, 
-            "line": {"color": "black", "width": 0.5}, 
-            #"label": ["Agricultural "waste"", "Bio-conversion", "Liquid", "Losses", "Solid", "Gas", "Biofuel imports", "Biomass imports", "Coal imports", "Coal", "Coal reserves", "District heating", "Industry", "Heating and cooling - commercial", "Heating and cooling - homes", "Electricity grid", "Over generation / exports", "H2 conversion", "Road transport", "Agriculture", "Rail transport", "Lighting & appliances - commercial", "Lighting & appliances - homes", "Gas imports", "Ngas", "Gas reserves", "Thermal generation", "Geothermal", "H2", "Hydro", "International shipping", "Domestic aviation", "International aviation", "National navigation", "Marine algae", "Nuclear", "Oil imports", "Oil", "Oil reserves", "Other waste", "Pumped heat", "Solar PV", "Solar Thermal", "Solar", "Tidal", "UK land based bioenergy", "Wave", "Wind"], 
-            #"color": ["rgba(31, 119, 180, 0.8)", "rgba(255, 127, 14, 0.8)", "rgba(44, 160, 44, 0.8)", "rgba(214, 39, 40, 0.8)", "rgba(148, 103, 189, 0.8)", "rgba(140, 86, 75, 0.8)", "rgba(227, 119, 194, 0.8)", "rgba(127, 127, 127, 0.8)", "rgba(188, 189, 34, 0.8)", "rgba(23, 190, 207, 0.8)", "rgba(31, 119, 180, 0.8)", "rgba(255, 127, 14, 0.8)", "rgba(44, 160, 44, 0.8)", "rgba(214, 39, 40, 0.8)", "rgba(148, 103, 189, 0.8)", "rgba(140, 86, 75, 0.8)", "rgba(227, 119, 194, 0.8)", "rgba(127, 127, 127, 0.8)", "rgba(188, 189, 34, 0.8)", "rgba(23, 190, 207, 0.8)", "rgba(31, 119, 180, 0.8)", "rgba(255, 127, 14, 0.8)", "rgba(44, 160, 44, 0.8)", "rgba(214, 39, 40, 0.8)", "rgba(148, 103, 189, 0.8)", "rgba(140, 86, 75, 0.8)", "rgba(227, 119, 194, 0.8)", "rgba(127, 127, 127, 0.8)", "rgba(188, 189, 34, 0.8)", "rgba(23, 190, 207, 0.8)", "rgba(31, 119, 180, 0.8)", "rgba(255, 127, 14, 0.8)", "rgba(44, 160, 44, 0.8)", "rgba(214, 39, 40, 0.8)", "rgba(148, 103, 189, 0.8)", "magenta", "rgba(227, 119, 194, 0.8)", "rgba(127, 127, 127, 0.8)", "rgba(188, 189, 34, 0.8)", "rgba(23, 190, 207, 0.8)", "rgba(31, 119, 180, 0.8)", "rgba(255, 127, 14, 0.8)", "rgba(44, 160, 44, 0.8)", "rgba(214, 39, 40, 0.8)", "rgba(148, 103, 189, 0.8)", "rgba(140, 86, 75, 0.8)", "rgba(227, 119, 194, 0.8)", "rgba(127, 127, 127, 0.8)"]
-            }, 
-        "link": {
-            #"source": [0, 1, 1, 1, 1, 6, 7, 8, 10, 9, 11, 11, 11, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 23, 25, 5, 5, 5, 5, 5, 27, 17, 17, 28, 29, 2, 2, 2, 2, 2, 2, 2, 2, 34, 24, 35, 35, 36, 38, 37, 39, 39, 40, 40, 41, 42, 43, 43, 4, 4, 4, 26, 26, 26, 44, 45, 46, 47, 35, 35], 
-            #"target": [1, 2, 3, 4, 5, 2, 4, 9, 9, 4, 12, 13, 14, 16, 14, 17, 12, 18, 19, 13, 3, 20, 21, 22, 24, 24, 13, 3, 26, 19, 12, 15, 28, 3, 18, 15, 12, 30, 18, 31, 32, 19, 33, 20, 1, 5, 26, 26, 37, 37, 2, 4, 1, 14, 13, 15, 14, 42, 41, 19, 26, 12, 15, 3, 11, 15, 1, 15, 15, 26, 26], 
-            #"value": [124.729, 0.597, 26.862, 280.322, 81.144, 35, 35, 11.606, 63.965, 75.571, 10.639, 22.505, 46.184, 104.453, 113.726, 27.14, 342.165, 37.797, 4.412, 40.858, 56.691, 7.863, 90.008, 93.494, 40.719, 82.233, 0.129, 1.401, 151.891, 2.096, 48.58, 7.013, 20.897, 6.242, 20.897, 6.995, 121.066, 128.69, 135.835, 14.458, 206.267, 3.64, 33.218, 4.413, 14.375, 122.952, 500, 139.978, 504.287, 107.703, 611.99, 56.587, 77.81, 193.026, 70.672, 59.901, 19.263, 19.263, 59.901, 0.882, 400.12, 46.477, 525.531, 787.129, 79.329, 9.452, 182.01, 19.013, 289.366, 100, 100] 
-            #"color": ["rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(33,102,172,0.35)", "rgba(178,24,43,0.35)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "rgba(0,0,96,0.2)", "lightgreen", "goldenrod"] 
-            #"label": ["stream 1", "", "", "", "stream 1", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "stream 1", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "Old generation plant (made-up)", "New generation plant (made-up)", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", ""]
-            }
-        }
-        ]
-
-    df_amp = filtered
-
-    # grab the contig GTDB classifications
-    df_amp[["kingdom", "phylum", "class", "order", "family", "genus", "specie"]] = df_amp["mmseqs_lineage_contig"].str.split(";", expand=True)
-    # remove the prefix from each column
-    df_amp["kingdom"] = df_amp["kingdom"].str.replace("d_", "")
-    df_amp["phylum"] = df_amp["phylum"].str.replace("p_", "")
-    df_amp["class"] = df_amp["class"].str.replace("c_", "")
-    df_amp["order"] = df_amp["order"].str.replace("o_", "")
-    df_amp["family"] = df_amp["family"].str.replace("f_", "")
-    df_amp["genus"] = df_amp["genus"].str.replace("g_", "")
-    df_amp["specie"] = df_amp["specie"].str.replace("s_", "")
-    # remove the letters used in GTDB formating
-    df_amp["phylum"] = df_amp["phylum"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    df_amp["class"] = df_amp["class"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    df_amp["order"] = df_amp["order"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    df_amp["family"] = df_amp["family"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    df_amp["genus"] = df_amp["genus"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    df_amp["specie"] = df_amp["specie"].str.replace(r"\s[A-Z](?!\w)", "", regex=True)
-    # remove the genus from specie column
-    df_amp["specie_mod"] = df_amp["specie"].str.split(" ", n=1).str[1]
-    
-    ########################
-    # (1-5) Kingdom//Phylum//Class/Genus
-    ########################
-    def create_taxonomy_nodes(df, level1, level2):
-        """
-        Create a dataframe of taxonomy nodes for the given levels:
-        Kingdom/Phylum/Class/Order/Family/Genus/Specie.
-        Parameters/inputs required:
-            df (pandas.DataFrame): the input dataframe containing the taxonomy data.
-            level1 (str): the name of the first level column.
-            level2 (str): the name of the second level column.
-        """
-        df_tax = pd.DataFrame()
-        df_tax[level1] = df[level1]
-        df_tax[level2] = df[level2]
-        df_tax = df_tax.groupby([level1, level2], sort=False, dropna=False).size().reset_index(name="count")
-        df_tax[f"{level1}_id"] = pd.factorize(df_tax[level1])[0]
-        max_value = (df_tax[f"{level1}_id"].max()+1)
-        df_tax[f"{level2}_id"] = pd.factorize(df_tax[level2])[0] + max_value
-        df_id = pd.melt(df_tax, value_vars=[f"{level1}_id", f"{level2}_id"], var_name="Category", value_name="node_id")
-        df_name = pd.melt(df_tax, value_vars=[level1, level2], var_name="Category", value_name="label")
-        df_tax_nodes = pd.concat([df_name, df_id["node_id"]], axis=1)
-        df_tax_nodes.drop_duplicates(keep="first", inplace=True, ignore_index=True)
-        return df_tax, df_tax_nodes, max_value
-    df_amp_KP, df_amp_nodes_KP, max_value = create_taxonomy_nodes(df_amp, "kingdom", "phylum")
-    df_amp_PC, df_amp_nodes_PC, max_value = create_taxonomy_nodes(df_amp, "phylum", "class")
-    df_amp_CO, df_amp_nodes_CO, max_value = create_taxonomy_nodes(df_amp, "class", "order")
-    df_amp_OF, df_amp_nodes_OF, max_value = create_taxonomy_nodes(df_amp, "order", "family")
-    df_amp_FG, df_amp_nodes_FG, max_value = create_taxonomy_nodes(df_amp, "family", "genus")
-    
-    ########################
-    # (6) Genus // Specie (sp.)
-    ########################
-    df_amp_GS = pd.DataFrame()
-    df_amp_GS["genus"] = df_amp["genus"]
-    df_amp_GS["specie"] = df_amp["specie_mod"]
-    # count the number of times the combinations are there for specie+genus
-    df_amp_GS = df_amp_GS.groupby(["genus", "specie"], sort=False, dropna=False).size().reset_index(name="count")
-    # replace string values with unique numbers in new columns
-    df_amp_GS["genus_id"] = pd.factorize(df_amp_GS["genus"])[0] + max_value
-    max_value = (df_amp_GS["genus_id"].max()+1) # grab the maximum value from the column
-    df_amp_GS["specie_id"] = pd.factorize(df_amp_GS["specie"])[0] + max_value
-    # stack them vertically
-    df_id = pd.melt(df_amp_GS, value_vars=["genus_id", "specie_id"], var_name="Category", value_name="node_id")
-    df_name = pd.melt(df_amp_GS, value_vars=["genus", "specie"], var_name="Category", value_name="label")
-    # merge the two melted DataFrames based on the index
-    df_amp_nodes_GS = pd.concat([df_name, df_id["node_id"]], axis=1)
-    # drop duplicates
-    df_amp_nodes_GS.drop_duplicates(keep="first", inplace=True, ignore_index=True)
-    
-    ########################
-    # (7) NODES labels
-    ########################
-    df_amp_nodes = pd.DataFrame()
-    # concatenate all nodes" labels
-    df_amp_nodes = pd.concat([df_amp_nodes_KP, df_amp_nodes_PC,
-                              df_amp_nodes_CO,df_amp_nodes_OF,
-                              df_amp_nodes_FG,df_amp_nodes_GS])
-    # drop unnecessary columns
-    df_amp_nodes.drop_duplicates(keep="first", inplace=True, ignore_index=True)
-    values_to_remove = [ "Category", "node_id"] 
-    df_amp_nodes.drop(values_to_remove,axis=1, inplace=True)
-    # remove empty rows
-    df_amp_nodes = df_amp_nodes.dropna()
-    # assign a number from 0 to inf
-    df_amp_nodes["node_id"] = range(len(df_amp_nodes))
-    # replace data[0]["node"]["label"] / ["color"] with user input
-    # convert column to list 
-    column_list = df_amp_nodes["label"].tolist()
-    # replace the "label" item in the "node" dictionary with the column list
-    data[0]["node"]["label"] = column_list
-    # generate distinct colors according to node_no
-    nodes_no = len(column_list) #number of nodes
-    color_list = []
-    for i in range(nodes_no):
-        hue = i / nodes_no
-        rgb = colorsys.hsv_to_rgb(hue, 1.0, 1.0)
-        rgba = tuple(int(255 * x) for x in rgb) + (0.8,)
-        color_string = f"rgba{rgba}"
-        color_list.append(color_string)
-    # replace the "color" item in the "node" dictionary with the color list
-    # color_list =  ["blue"] * 137
-    data[0]["node"]["color"] = color_list
-    
-    ########################
-    # (8) COUNTS labels
-    ########################
-    # replace the contents of xx_id with the correct digits
-    # drop unnecessary columns
-    dataframes = [df_amp_KP, df_amp_PC, df_amp_CO, df_amp_OF, df_amp_FG, df_amp_GS]
-    for df in dataframes:
-        columns_to_remove = [col for col in df.columns if "_id" in col]
-        df.drop(columns_to_remove, axis=1, inplace=True)
-    # stack columns in order
-    # rename columns
-    dataframes = [df_amp_KP, df_amp_PC, df_amp_CO, df_amp_OF, df_amp_FG, df_amp_GS]
-    for df in dataframes:
-        df.columns = ["source", "target", "count"]
-    df_amp_counts = pd.concat([df_amp_KP, df_amp_PC, df_amp_CO,
-                               df_amp_OF, df_amp_FG, df_amp_GS], axis=0, ignore_index=True)
-    # remove rows that have no values in two columns
-    df_amp_counts = df_amp_counts.dropna(subset=["source", "target"])
-    # labels and digits to dict
-    label_dict = df_amp_nodes.set_index("label")["node_id"].to_dict()
-    # replace the values in the "source" column with digits
-    df_amp_counts["source_digit"] = df_amp_counts["source"].replace(label_dict).astype(int)
-    # replace the values in the "target" column with digits
-    #df_amp_counts["target_digit"] = df_amp_counts["target"].replace(label_dict)
-    df_amp_counts["target_digit"] = df_amp_counts["target"].map(label_dict).astype(int)
-    # replace data[0]["link"]["source"] / ["target"] / ["value"] / ["color"] with user input
-    # convert columns to list 
-    column_list = df_amp_counts["count"].tolist()
-    data[0]["link"]["value"] = column_list
-    column_list = df_amp_counts["target_digit"].tolist()
-    data[0]["link"]["target"] = column_list
-    column_list = df_amp_counts["source_digit"].tolist()
-    data[0]["link"]["source"] = column_list
-    # make sure the values in the list are integers 
-    data[0]["link"]["source"] = [int(src) for src in data[0]["link"]["source"]]
-    data[0]["link"]["target"] = [int(src) for src in data[0]["link"]["target"]]
-    data[0]["link"]["value"] = [int(src) for src in data[0]["link"]["value"]]
-    
-    ########################
-    # (9) Prepare for the Sankey diagram
-    ########################
+# Taxa kept per rank in the Sankey plot; the remaining ones are merged into an "Other" node
+SANKEY_TOP_N = 15
+
+SANKEY_OTHER = "Other"
+
+
+def sankey_paths(data):
+    """
+    Unique lineages of `data` as one row of cleaned names per rank (None where a rank is missing), with
+    the number of BGCs per lineage in "count". Names are cleaned once per category: GTDB suffix letters
+    are removed below the domain, and species are reduced to the epithet.
+    """
+    ranks = preprocess_taxonomy_column(data)
+    codes = pd.DataFrame({level: ranks[level].cat.codes.to_numpy() for level in TAXONOMY_LEVELS})
+    paths = codes.groupby(TAXONOMY_LEVELS, sort=False).size().reset_index(name="count")
+
+    for level in TAXONOMY_LEVELS:
+        names = ranks[level].cat.categories
+        if level != "Domain":
+            # remove the letters used in GTDB formating
+            names = names.str.replace(r"\s[A-Z](?!\w)", "", regex=True)
+        if level == "Species":
+            # remove the genus from specie column
+            names = names.str.split(" ", n=1).str[1]
+        paths[level] = np.append(np.asarray(names, dtype=object), None)[paths[level].to_numpy()]
+    return paths
+
+
+def sankey_links(paths, top_n=SANKEY_TOP_N):
+    """
+    Nodes keyed by (rank, name) and the links between consecutive ranks of the lineage paths.
+    Per rank only the `top_n` taxa with the most BGCs are kept, the others are merged into an "Other" node.
+    Returns the node keys and a frame of source and target node numbers with the BGC count of each link.
+    """
+    paths = paths.copy()
+    for level in TAXONOMY_LEVELS:
+        totals = paths.groupby(level)["count"].sum().sort_values(ascending=False, kind="stable")
+        pruned = ~paths[level].isin(totals.index[:top_n]) & paths[level].notna()
+        paths.loc[pruned, level] = SANKEY_OTHER
+
+    links = []
+    for source, target in zip(TAXONOMY_LEVELS[:-1], TAXONOMY_LEVELS[1:]):
+        pairs = paths.dropna(subset=[source, target]).groupby([source, target], sort=False)["count"].sum().reset_index()
+        links.append(pd.DataFrame({
+            "source": list(zip([source] * len(pairs), pairs[source])),
+            "target": list(zip([target] * len(pairs), pairs[target])),
+            "count": pairs["count"].to_numpy(),
+        }))
+    links = pd.concat(links, ignore_index=True)
+
+    # Number the nodes rank by rank, in order of first appearance
+    nodes = list(dict.fromkeys(key for pair in zip(links["source"], links["target"]) for key in pair))
+    nodes.sort(key=lambda key: TAXONOMY_LEVELS.index(key[0]))
+    numbers = {key: number for number, key in enumerate(nodes)}
+    links["source"] = links["source"].map(numbers)
+    links["target"] = links["target"].map(numbers)
+    return nodes, links
+
+
+def plot_combgc_sankey(filtered, top_n=SANKEY_TOP_N):
+    nodes, links = sankey_links(sankey_paths(filtered), top_n=top_n)
+    checkpoint()
+
+    # generate distinct colors according to node_no; links take the color of their source node
+    colors = []
+    for i in range(len(nodes)):
+        rgb = colorsys.hsv_to_rgb(i / max(len(nodes), 1), 1.0, 1.0)
+        colors.append(tuple(int(255 * x) for x in rgb))
+    node_colors = [f"rgba{color + (0.8,)}" for color in colors]
+    link_colors = [f"rgba{colors[source] + (0.2,)}" for source in links["source"]]
+
     # Adapted from https://python-graph-gallery.com/sankey-diagram-with-python-and-plotly/
-    # override gray link colors with "source" colors
-    opacity = 0.4
-    # change "magenta" to its "rgba" value to add opacity
-    data[0]["node"]["color"] = ["rgba(255,0,255, 0.8)" if color == "magenta" else color for color in data[0]["node"]["color"]]
-    data[0]["link"]["color"] = [data[0]["node"]["color"][src].replace("0.8", str(opacity))
-                                        for src in data[0]["link"]["source"]]
-    # change opacity of the links
-    data[0]["link"]["color"] = [color.replace("0.4", "0.2") for color in data[0]["link"]["color"]]
-    
     fig = go.Figure(data=[go.Sankey(
         valueformat = ".0f",
-        valuesuffix = "TWh",
         # Define nodes
         node = dict(
           pad = 15,
           thickness = 15,
           line = dict(color = "black", width = 0.5),
-          label =  data[0]["node"]["label"],
-          color =  data[0]["node"]["color"],
-          hovertemplate="%{label}<extra></extra>",
+          label =  [name for level, name in nodes],
+          customdata = [level for level, name in nodes],
+          color =  node_colors,
+          hovertemplate="%{label} (%{customdata})<extra></extra>",
           hoverlabel=dict(font=dict(family="Arial")),
           ),
         # Add links
         link = dict(
-          source =  data[0]["link"]["source"],
-          target =  data[0]["link"]["target"],
-          value =  data[0]["link"]["value"],
-          label =  data[0]["link"]["value"],
-          color =  data[0]["link"]["color"]
+          source =  links["source"].tolist(),
+          target =  links["target"].tolist(),
+          value =  links["count"].tolist(),
+          label =  links["count"].tolist(),
+          color =  link_colors
     ))],)             
+    checkpoint()
     fig.update_layout(title_text="Contig taxonomic lineage for AMP hits based on MMseqs2 classification - Sankey plot ",
                       font_size=12)
-    #show plot:
-    #fig.show()
 
     fig.update_layout(
         font=dict(family="Arial", size=10.5, color="black"),
         hoverlabel=dict(font=dict(family="Arial"))
     )
-    #save the plot in html format :
-    #fig.write_html("combgc_sankey_plot.html")
-    #fig.write_image("combgc_sankey_plot.pdf")
-    #fig.write_image("combgc_sankey_plot.png", scale=5)
-    return fig.show()
+    return fig
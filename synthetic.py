@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from loader import TOOL_COLUMNS, add_derived_columns, apply_schema, contig_lengths, iter_tsv, read_combgc_table
+
+###########################################
+#      SYNTHETIC COMBGC TABLES
+###########################################
+# Fixtures the distributions are learned from: BGC annotations from the first, contig lineages from the second
+FIXTURE = Path(__file__).parent / "tests" / "filtered_bgcs.tsv"
+LINEAGE_FIXTURE = Path(__file__).parent / "tests" / "filtered_bgcs_meta.tsv"
+
+# Columns drawn together from one fixture BGC, so that tools, classes, lengths and scores stay consistent
+BGC_COLUMNS = ["BGC_length", *TOOL_COLUMNS, "merged", "Product_class", "Tool_representative", "BGC_probability"]
+
+
+class TableProfile:
+    """
+    Empirical distributions of a comBGC table: BGCs per sample, BGCs per contig, contig lengths and
+    coverages, the BGC annotations (BGC_COLUMNS) and the contig lineages. Synthetic tables are drawn
+    from them with replacement.
+    """
+    def __init__(self, fixture=FIXTURE, lineage_fixture=LINEAGE_FIXTURE):
+        table = read_combgc_table(fixture)
+        self.sample_sizes = table.groupby("sample_id", observed=True).size().to_numpy()
+        contigs = table.groupby(["sample_id", "contig_id"], observed=True)
+        self.bgcs_per_contig = len(table) / contigs.ngroups
+
+        contig_ids = table["contig_id"].astype(str)
+        self.contig_lengths = contig_lengths(table).dropna().to_numpy(dtype=np.int64)
+        self.coverages = contig_ids.str.extract(r"_cov_([\d.]+)")[0].astype(float).dropna().to_numpy()
+        self.bgcs = table[BGC_COLUMNS].reset_index(drop=True)
+
+        lineages = read_combgc_table(lineage_fixture)
+        lineages = lineages.drop_duplicates(["sample_id", "contig_id"])["mmseqs_lineage_contig"].astype(str)
+        self.lineages = lineages.to_numpy()
+
+
+def synthesize_table(rows, seed=0, profile=None, bgcs_per_contig=None, lineage_variants=1):
+    """
+    A typed comBGC table of `rows` BGCs, as read by loader.read_combgc_table, drawn from `profile`
+    (default: learned from the fixtures). Samples and contigs are numbered; each BGC lies within its
+    contig, and contig IDs follow the "NODE_1_length_30101_cov_36.6" pattern.
+    `bgcs_per_contig` overrides the fixture's average, e.g. to produce overlapping BGCs.
+    With `lineage_variants` > 1 every lineage is split into that many variants of its deepest rank,
+    for high-cardinality taxonomy levels.
+    """
+    profile = profile or TableProfile()
+    rng = np.random.default_rng(seed)
+
+    # Samples with fixture-like sizes; contigs are numbered across samples and never shared between them
+    sizes = rng.choice(profile.sample_sizes, size=max(1, int(np.ceil(rows / profile.sample_sizes.mean()))))
+    sample_of_row = np.sort(rng.choice(len(sizes), size=rows, p=sizes / sizes.sum()))
+    n_contigs = max(1, int(round(rows / (bgcs_per_contig or profile.bgcs_per_contig))))
+    contig_of_row = np.sort(rng.integers(0, n_contigs, size=rows))
+    contig_codes = np.unique(sample_of_row.astype(np.int64) * n_contigs + contig_of_row, return_inverse=True)[1].reshape(-1)
+    n_used = int(contig_codes.max(initial=-1)) + 1
+
+    # BGC annotations drawn as whole fixture rows
+    bgcs = profile.bgcs.iloc[rng.integers(0, len(profile.bgcs), size=rows)].reset_index(drop=True)
+    bgc_lengths = bgcs["BGC_length"].to_numpy(dtype=np.int64)
+
+    # Contigs at least as long as their longest BGC, which is placed uniformly within them
+    required = np.zeros(n_used, dtype=np.int64)
+    np.maximum.at(required, contig_codes, bgc_lengths + 1)
+    lengths = np.maximum(rng.choice(profile.contig_lengths, size=n_used), required)
+    coverages = rng.choice(profile.coverages, size=n_used)
+    starts = (rng.random(rows) * (lengths[contig_codes] - bgc_lengths)).astype(np.int64) + 1
+    contig_names = [f"NODE_{i + 1}_length_{length}_cov_{coverage:.1f}" for i, (length, coverage) in enumerate(zip(lengths, coverages))]
+
+    lineages = pd.Series(rng.choice(profile.lineages, size=n_used))
+    if lineage_variants > 1:
+        variants = pd.Series(rng.integers(0, lineage_variants, size=n_used))
+        split = (variants > 0) & (lineages != "")
+        lineages[split] = lineages[split] + " v" + variants[split].astype(str)
+    lineages = pd.Categorical(lineages)
+
+    table = pd.DataFrame({
+        "sample_id": pd.Categorical.from_codes(sample_of_row, categories=[f"SYN{i:05d}-megahit" for i in range(len(sizes))]),
+        "contig_id": pd.Categorical.from_codes(contig_codes, categories=contig_names),
+        "BGC_start": starts,
+        "BGC_end": starts + bgc_lengths,
+        **{column: bgcs[column] for column in BGC_COLUMNS},
+        "mmseqs_lineage_contig": pd.Categorical.from_codes(lineages.codes[contig_codes], categories=lineages.categories),
+    })
+    return add_derived_columns(apply_schema(table))
+
+
+def write_table(table, path, compress=False):
+    """
+    Write a (synthetic) table as a comBGC TSV, gzip-compressed when `compress` is set.
+    """
+    with open(path, "wb") as handle:
+        for chunk in iter_tsv(table, compress=compress):
+            handle.write(chunk.encode() if isinstance(chunk, str) else chunk)
@@ -0,0 +1,170 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from loader import export_frame
+
+###########################################
+#      PAGED TABLE ENGINE
+###########################################
+# Rows per page offered in the table tabs
+PAGE_SIZES = ["25", "50", "100", "500"]
+
+# Column holding the stable row ID (the row position in the loaded dataset)
+ROW_ID_COLUMN = "row_id"
+
+_NUMBER = r"(-?\d+(?:\.\d+)?)"
+_RANGE = re.compile(rf"^\s*{_NUMBER}\s*(?:-|\.\.)\s*{_NUMBER}\s*$")
+_COMPARISON = re.compile(rf"^\s*(<=|>=|<|>|=)?\s*{_NUMBER}\s*$")
+
+
+class RowView:
+    """
+    The rows at positions `rows` of `table`, passed around instead of a copied frame.
+    """
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def frame(self):
+        return self.table.iloc[self.rows]
+
+    def contains(self, positions):
+        """
+        Boolean mask of the row positions that belong to the view, by binary search in the sorted rows.
+        """
+        positions = np.asarray(positions)
+        if len(self.rows) == 0:
+            return np.zeros(len(positions), dtype=bool)
+        found = np.searchsorted(self.rows, positions)
+        return (found < len(self.rows)) & (self.rows[np.minimum(found, len(self.rows) - 1)] == positions)
+
+
+class PagedTable:
+    """
+    Server-side filtering, sorting and paging over a table whose index holds stable row IDs.
+    Only the requested window is converted for display, the rest of the table stays in memory.
+    `table` may be a RowView, whose rows are then paged without copying them out of the table.
+    """
+    def __init__(self, table):
+        if isinstance(table, RowView):
+            self.table, self.base = table.table, np.asarray(table.rows)
+        else:
+            self.table, self.base = table, np.arange(len(table))
+
+    def __len__(self):
+        return len(self.base)
+
+    def rows(self, filters=None, sort_by=None, ascending=True):
+        """
+        Row positions matching all `filters` ({column: pattern}), ordered by `sort_by`.
+        """
+        mask = np.ones(len(self.base), dtype=bool)
+        for column, pattern in (filters or {}).items():
+            if column in self.table.columns and pattern and pattern.strip():
+                mask &= column_mask(self.table[column].iloc[self.base], pattern)
+        positions = self.base[mask]
+
+        if sort_by in self.table.columns:
+            keys = sort_keys(self.table[sort_by].iloc[positions])
+            order = np.argsort(keys if ascending else -keys, kind="stable")
+            positions = positions[order]
+        return positions
+
+    def page(self, positions, page, page_size):
+        """
+        The display frame of page `page` (1-based) of `positions`, with the row IDs as first column.
+        """
+        start = (page - 1) * page_size
+        window = self.table.iloc[positions[start:start + page_size]]
+        window = display_frame(export_frame(window))
+        window.insert(0, ROW_ID_COLUMN, window.index)
+        return window
+
+    def row_ids(self, row_ids):
+        """
+        The given stable row IDs that are in the table, sorted. Unknown IDs are ignored.
+        """
+        return sorted(self.table.index[self.base].intersection(row_ids))
+
+    def take(self, row_ids):
+        """
+        Rows of the table for the given stable row IDs, in table order. Unknown IDs are ignored.
+        """
+        return self.table.loc[self.table.index[self.base].intersection(row_ids)]
+
+
+def display_frame(df):
+    """
+    `df` with categorical columns as plain values; the data grid would otherwise send every category
+    of the whole table along with each page.
+    """
+    return df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+
+def page_count(n_rows, page_size):
+    return max(1, -(-n_rows // page_size))
+
+
+def parse_filters(text):
+    """
+    Parse "column: pattern; column: pattern" into a {column: pattern} dict.
+    """
+    filters = {}
+    for part in (text or "").split(";"):
+        column, separator, pattern = part.partition(":")
+        if separator and column.strip() and pattern.strip():
+            filters[column.strip()] = pattern.strip()
+    return filters
+
+
+###########################################
+#      COLUMN FILTERS
+###########################################
+def column_mask(values, pattern):
+    """
+    Boolean mask of `values` matching a filter pattern:
+    numeric columns accept "5000", ">5000", "<=300" or "1000-5000"; tool flags accept "yes"/"no";
+    text columns match a case-insensitive substring, evaluated once per category.
+    """
+    pattern = pattern.strip()
+    if values.dtype == bool:
+        return values.to_numpy() == (pattern.lower() in ("yes", "true", "1"))
+
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        numbers = values.to_numpy(dtype=float, na_value=np.nan)
+        match = _RANGE.match(pattern)
+        if match:
+            low, high = sorted(float(bound) for bound in match.groups())
+            return (numbers >= low) & (numbers <= high)
+        match = _COMPARISON.match(pattern)
+        if not match:
+            return np.zeros(len(values), dtype=bool)
+        operator, number = match.group(1) or "=", float(match.group(2))
+        return {
+            "<": numbers < number, "<=": numbers <= number,
+            ">": numbers > number, ">=": numbers >= number,
+            "=": numbers == number,
+        }[operator]
+
+    values = values.astype("category")
+    category_mask = values.cat.categories.astype(str).str.contains(pattern, case=False, regex=False)
+    return np.append(np.asarray(category_mask, dtype=bool), False)[values.cat.codes.to_numpy()]
+
+
+def sort_keys(values):
+    """
+    Numeric sort keys for a column; categories are ranked alphabetically and missing values sort last.
+    """
+    if values.dtype == bool:
+        return values.to_numpy().astype(float)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    values = values.astype("category")
+    categories = values.cat.categories.astype(str)
+    rank = np.append(np.argsort(np.argsort(categories)).astype(float), np.nan)
+    return rank[values.cat.codes.to_numpy()]
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+import pytest
+
+from background import BuildCancelled, CancelToken, checkpoint, run_in_background
+
+
+def blocking_build(started, release, calls):
+    def build(name):
+        calls.append(name)
+        started.set()
+        release.wait(5)
+        checkpoint()
+        calls.append(f"{name} done")
+        return name
+    return build
+
+
+def test_cancelled_build_stops_at_checkpoint():
+    async def main():
+        started, release, calls = threading.Event(), threading.Event(), []
+        token = CancelToken()
+        run = asyncio.ensure_future(run_in_background(blocking_build(started, release, calls), "a", token=token))
+        await asyncio.to_thread(started.wait, 5)
+        token.cancel()
+        release.set()
+        with pytest.raises(BuildCancelled):
+            await run
+        return calls
+    assert asyncio.run(main()) == ["a"]
+
+
+def test_superseded_run_never_takes_a_worker():
+    async def main():
+        started, release, calls = threading.Event(), threading.Event(), []
+        build = blocking_build(started, release, calls)
+        slots = asyncio.Semaphore(1)
+        first = asyncio.ensure_future(run_in_background(build, "first", slots=slots))
+        await asyncio.to_thread(started.wait, 5)
+        second = asyncio.ensure_future(run_in_background(build, "second", slots=slots))
+        await asyncio.sleep(0.05)
+        second.cancel()
+
+        # Cancelling the first run does not free its slot while its call is still in the pool
+        first.cancel()
+        third = asyncio.ensure_future(run_in_background(build, "third", slots=slots))
+        await asyncio.sleep(0.05)
+        assert calls == ["first"]
+        release.set()
+        assert await third == "third"
+        return calls
+    assert asyncio.run(main()) == ["first", "first done", "third", "third done"]
+
+
+def test_checkpoint_outside_background_run():
+    checkpoint()
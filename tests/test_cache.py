@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from cache import TableCache
+from loader import read_combgc_table
+
+pytest.importorskip("pyarrow")
+
+FIXTURE = Path(__file__).parent / "filtered_bgcs.tsv"
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = TableCache(tmp_path)
+    cache.path("key").write_bytes(b"not a parquet file")
+    table = cache.load(FIXTURE, read_combgc_table, key="key")
+    assert len(table) == len(read_combgc_table(FIXTURE))
+    assert len(cache.get("key")) == len(table)  # the parsed table replaced the corrupt entry
+
+
+def test_failed_write_returns_the_table(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+
+    cache = TableCache(tmp_path)
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", fail)
+    table = cache.load(FIXTURE, read_combgc_table, key="key")
+    assert len(table) == len(read_combgc_table(FIXTURE))
+    assert cache.get("key") is None
+    assert not list(tmp_path.iterdir())  # no temporary file left behind
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset import CUBE_DIMENSIONS, ComBGCDataset, LengthIndex, ProductClassIndex
+from loader import read_combgc_table, tool_codes
+from modules import filter_counts, filter_data
+from synthetic import synthesize_table
+
+FIXTURE = Path(__file__).parent / "filtered_bgcs.tsv"
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = read_combgc_table(FIXTURE)
+    # Missing values the fixture does not have: no Product_class (code -1) and no BGC_length
+    table["Product_class"] = table["Product_class"].astype(object).where(np.arange(len(table)) % 50 != 7)
+    table["BGC_length"] = table["BGC_length"].astype(float).where(np.arange(len(table)) % 40 != 3)
+    return table
+
+
+def baseline_class_mask(product_class, selected):
+    return product_class.apply(lambda x: any(item in selected for item in x.split(", ")) if pd.notna(x) else False).to_numpy(dtype=bool)
+
+
+@pytest.mark.parametrize("selected", [
+    ["Unknown"],
+    ["Terpene"],
+    ["NRP", "RiPP"],
+    ["Polyketide", "Terpene", "Arylpolyene"],
+    ["not a class"],
+])
+def test_product_class_mask(table, selected):
+    index = ProductClassIndex(table["Product_class"])
+    assert table["Product_class"].isna().any()
+    assert np.array_equal(index.mask(selected), baseline_class_mask(table["Product_class"], selected))
+
+
+def test_product_class_vocabulary_splits_multi_class_values(table):
+    index = ProductClassIndex(table["Product_class"])
+    assert "Terpene" in index.vocabulary and "Terpene, Unknown" not in index.vocabulary
+    assert not index.value_mask(["Terpene"])[-1]  # the slot code -1 picks
+
+
+@pytest.mark.parametrize("bounds", [(3000, 1000000), (0, float("inf")), (6044, 6044), (10000, 5000), (-5, 0)])
+def test_length_index(table, bounds):
+    index = LengthIndex(table["BGC_length"])
+    assert table["BGC_length"].isna().any()
+    expected = table["BGC_length"].between(*bounds).to_numpy(dtype=bool)
+    assert np.array_equal(index.mask(*bounds), expected)
+    assert index.count(*bounds) == expected.sum()
+    assert set(index.rows(*bounds)) == set(np.flatnonzero(expected))
+
+
+def cube_counts(counts):
+    counts = counts[counts["count"] > 0]
+    keys = zip(*(counts[column].astype(object) for column in CUBE_DIMENSIONS + ["tool_code"]))
+    keys = (tuple(None if pd.isna(value) else value for value in key) for key in keys)
+    return dict(zip(keys, counts["count"].astype(int)))
+
+
+@pytest.fixture(scope="module", params=["fixture", "synthetic"])
+def dataset(request, table):
+    if request.param == "fixture":
+        return ComBGCDataset(table.assign(Product_class=table["Product_class"].astype("category")))
+    synthetic = synthesize_table(20000, seed=3)
+    synthetic["Product_class"] = synthetic["Product_class"].astype(object).where(np.arange(len(synthetic)) % 31 != 5)
+    synthetic["Product_class"] = synthetic["Product_class"].astype("category")
+    synthetic["BGC_length"] = synthetic["BGC_length"].astype(float).where(np.arange(len(synthetic)) % 23 != 2)
+    return ComBGCDataset(synthetic)
+
+
+@pytest.mark.parametrize("filters", [
+    (True, True, True, False, [], 0, float("inf")),
+    (True, False, False, False, [], 3000, 9000),
+    (False, True, True, False, ["Terpene", "NRP"], 5123, 40321),
+    (True, True, True, True, [], 0, 20000),
+    (True, True, True, False, ["Polyketide"], 6044, 6044),
+    (True, True, True, False, [], 10000, 10500),
+    (True, True, True, False, [], -100, 10),
+    (True, True, True, False, [], 10 ** 9, 10 ** 10),
+    (True, True, True, False, [], 9000, 3000),
+])
+def test_count_cube_slice(dataset, filters):
+    rows = filter_data(dataset, *filters)
+    expected = rows.assign(tool_code=tool_codes(rows)).groupby(CUBE_DIMENSIONS + ["tool_code"], observed=True, dropna=False).size()
+    assert cube_counts(filter_counts(dataset, *filters)) == cube_counts(expected.reset_index(name="count"))
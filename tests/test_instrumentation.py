@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import input_rows, rows_of
+from table_engine import RowView
+
+
+def test_rows_default_to_the_result():
+    assert input_rows(None, (), {}, pd.DataFrame({"a": range(3)})) == 3
+    assert input_rows(None, (), {}, "not a table") is None
+
+
+def test_rows_of_the_consumed_input():
+    view = RowView(pd.DataFrame({"a": range(10)}), np.array([1, 2, 3]))
+    table = pd.DataFrame({"a": range(10)})
+    assert input_rows(rows_of(lambda: table), (), {}, view) == 10
+    assert input_rows(lambda frame: len(frame), (table,), {}, np.zeros(3, dtype=bool)) == 10
+    assert input_rows(rows_of(lambda: None), (), {}, view) is None
+
+
+def test_failing_rows_are_not_recorded():
+    def fail():
+        raise ValueError()
+    assert input_rows(rows_of(fail), (), {}, pd.DataFrame({"a": range(3)})) is None
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intervals import ContigIntervalIndex
+
+
+def make_table(records):
+    table = pd.DataFrame(records, columns=["sample_id", "contig_id", "BGC_start", "BGC_end"])
+    table["sample_id"] = table["sample_id"].astype("category")
+    table["contig_id"] = table["contig_id"].astype("category")
+    table["BGC_start"] = table["BGC_start"].astype(float)
+    table["BGC_end"] = table["BGC_end"].astype(float)
+    return table
+
+
+def random_table(rows, seed):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 5000, rows)
+    ends = starts + rng.integers(0, 400, rows)
+    # A few long BGCs, so queries far behind a start still have to look back to them
+    ends[rng.random(rows) < 0.05] += 3000
+    table = make_table({
+        "sample_id": rng.choice(["S1", "S2"], rows),
+        "contig_id": rng.choice(["c1", "c2", "c3"], rows),
+        "BGC_start": starts,
+        "BGC_end": ends,
+    })
+    table.loc[rng.random(rows) < 0.05, "BGC_start"] = np.nan
+    return table
+
+
+def brute_query(table, sample_id, contig_id, start, end):
+    hits = (table["sample_id"] == sample_id) & (table["contig_id"] == contig_id) & (table["BGC_end"] >= start) & (table["BGC_start"] <= end)
+    return sorted(np.flatnonzero(hits.to_numpy()))
+
+
+def brute_join(table, rows, others, min_overlap):
+    rows, others = np.asarray(rows)[:, None], np.asarray(others)[None, :]
+    starts, ends = table["BGC_start"].to_numpy(), table["BGC_end"].to_numpy()
+    samples, contigs = table["sample_id"].to_numpy(), table["contig_id"].to_numpy()
+    overlap = np.minimum(ends[rows], ends[others]) - np.maximum(starts[rows], starts[others]) + 1
+    keep = (rows != others) & (samples[rows] == samples[others]) & (contigs[rows] == contigs[others]) & (overlap >= max(min_overlap, 1))
+    rows, others = np.broadcast_arrays(rows, others)
+    return set(zip(rows[keep], others[keep], overlap[keep].astype(int)))
+
+
+def join_pairs(frame):
+    return set(zip(frame["row_id"], frame["other_row_id"], frame["overlap"]))
+
+
+def test_query_looks_back_by_the_longest_bgc():
+    table = make_table([
+        ("S1", "c1", 100, 5000),   # long BGC, found only through the lookback
+        ("S1", "c1", 200, 300),
+        ("S1", "c1", 4000, 4100),
+        ("S1", "c2", 4500, 4600),
+    ])
+    index = ContigIntervalIndex(table)
+    assert sorted(index.query("S1", "c1", 4500, 4600)) == [0]
+    assert sorted(index.query("S1", "c1", 5000, 6000)) == [0]
+    assert sorted(index.query("S1", "c1", 5001, 6000)) == []  # within the lookback, but past every end
+    assert sorted(index.query("S1", "c1", 300, 4000)) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_query_matches_brute_force(seed):
+    table = random_table(300, seed)
+    index = ContigIntervalIndex(table)
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(200):
+        start = int(rng.integers(-100, 9000))
+        end = start + int(rng.integers(0, 500))
+        sample, contig = rng.choice(["S1", "S2"]), rng.choice(["c1", "c2", "c3"])
+        assert sorted(index.query(sample, contig, start, end)) == brute_query(table, sample, contig, start, end)
+
+
+def test_query_on_unknown_contig_or_sample():
+    index = ContigIntervalIndex(random_table(50, 0))
+    assert len(index.query("S1", "not a contig", 0, 10 ** 6)) == 0
+    assert len(index.query("not a sample", "c1", 0, 10 ** 6)) == 0
+
+
+@pytest.mark.parametrize("min_overlap", [1, 50, 300])
+def test_overlap_join_matches_brute_force(min_overlap):
+    table = random_table(120, 4)
+    index = ContigIntervalIndex(table)
+    rows, others = np.arange(0, 120, 2), np.arange(60, 120)
+    assert join_pairs(index.overlap_join(min_overlap=min_overlap)) == brute_join(table, range(120), range(120), min_overlap)
+    assert join_pairs(index.overlap_join(rows, others, min_overlap)) == brute_join(table, rows, others, min_overlap)
+
+
+def test_empty_table():
+    index = ContigIntervalIndex(make_table([]))
+    assert len(index) == 0
+    assert len(index.query("S1", "c1", 0, 100)) == 0
+    assert len(index.overlap_join()) == 0
+    assert list(index.overlap_join().columns) == ["row_id", "other_row_id", "overlap"]
@@ -0,0 +1,41 @@
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+
+from loader import SOURCE_FILE_COLUMN, has_pyarrow, read_combgc_table, read_combgc_tables
+
+FIXTURE = Path(__file__).parent / "filtered_bgcs.tsv"
+
+
+def test_archives_with_equally_named_members(tmp_path):
+    with zipfile.ZipFile(tmp_path / "batch1.zip", "w") as archive:
+        archive.write(FIXTURE, "one.tsv")
+    with tarfile.open(tmp_path / "batch2.tar.gz", "w:gz") as archive:
+        archive.add(FIXTURE, "one.tsv")
+
+    table = read_combgc_tables([
+        ("batch1.zip", tmp_path / "batch1.zip"),
+        ("batch2.tar.gz", tmp_path / "batch2.tar.gz"),
+    ])
+    counts = table[SOURCE_FILE_COLUMN].value_counts()
+    assert sorted(counts.index) == ["batch1.zip/one.tsv", "batch2.tar.gz/one.tsv"]
+    assert counts["batch1.zip/one.tsv"] == counts["batch2.tar.gz/one.tsv"] == len(table) // 2
+
+
+def test_tables_with_different_optional_columns(tmp_path):
+    full = pd.read_csv(FIXTURE, sep="\t", nrows=20)
+    full.drop(columns=["BGC_probability", "mmseqs_lineage_contig"]).to_csv(tmp_path / "bare.tsv", sep="\t", index=False)
+    full.drop(columns=["merged"]).to_csv(tmp_path / "lineage.tsv", sep="\t", index=False)
+
+    for engine in ["c", "pyarrow"] if has_pyarrow() else ["c"]:
+        table = read_combgc_tables([("bare.tsv", tmp_path / "bare.tsv"), ("lineage.tsv", tmp_path / "lineage.tsv")], engine=engine)
+        single = read_combgc_table(FIXTURE, engine=engine)
+        assert len(table) == 40
+        for column in ["BGC_probability", "mmseqs_lineage_contig", "merged", "BGC_start", "deepBGC", "sample_id"]:
+            assert str(table[column].dtype) == str(single[column].dtype), column
+        assert table["BGC_probability"].iloc[:20].isna().all()
+        assert table["BGC_probability"].iloc[20:].notna().all()
+        assert (table["mmseqs_lineage_contig"].iloc[:20] == "").all()
+        assert (table["merged"].iloc[20:] == 1).all()
@@ -0,0 +1,128 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from loader import TOOL_COLUMNS, tool_codes
+from merging import merge_bgcs
+from synthetic import synthesize_table
+
+FRACTIONS = [0.0, 0.5, 1.0]
+
+
+def make_table(records):
+    """
+    A typed table with the given (contig_id, BGC_start, BGC_end) BGCs of one sample.
+    """
+    table = synthesize_table(len(records), seed=0)
+    contigs, starts, ends = zip(*records)
+    table["sample_id"] = pd.Categorical(["S1"] * len(records))
+    table["contig_id"] = pd.Categorical(contigs)
+    table["BGC_start"] = np.array(starts, dtype=np.int32)
+    table["BGC_end"] = np.array(ends, dtype=np.int32)
+    table["BGC_length"] = table["BGC_end"] - table["BGC_start"]
+    return table
+
+
+def summary(table, clusters):
+    """
+    Multiset of (sample, contig, start, end, merged, tool code) of clusters given as lists of row positions.
+    """
+    codes = tool_codes(table)
+    return Counter(
+        (
+            table["sample_id"].iloc[rows[0]], table["contig_id"].iloc[rows[0]],
+            int(table["BGC_start"].iloc[rows].min()), int(table["BGC_end"].iloc[rows].max()),
+            int(table["merged"].iloc[rows].sum()), int(np.bitwise_or.reduce(codes[rows])),
+        )
+        for rows in clusters
+    )
+
+
+def merged_summary(table, fraction):
+    merged = merge_bgcs(table, fraction)
+    return summary(merged, [[row] for row in np.flatnonzero(merged["BGC_start"].notna().to_numpy())])
+
+
+def sweep_clusters(table, fraction):
+    """
+    The documented rule, one BGC at a time: join the open cluster when overlapping the furthest-reaching
+    earlier BGC of the contig by at least `fraction` of the shorter of the two, and by at least 1 bp.
+    """
+    starts, ends = table["BGC_start"].to_numpy(dtype=float), table["BGC_end"].to_numpy(dtype=float)
+    samples, contigs = table["sample_id"].cat.codes.to_numpy(), table["contig_id"].cat.codes.to_numpy()
+    rows = sorted((row for row in range(len(table)) if not np.isnan(starts[row])), key=lambda row: (samples[row], contigs[row], starts[row], row))
+    clusters, furthest = [], None
+    for row in rows:
+        same_contig = furthest is not None and (samples[furthest], contigs[furthest]) == (samples[row], contigs[row])
+        if same_contig:
+            overlap = min(ends[furthest], ends[row]) - starts[row]
+            shorter = min(ends[furthest] - starts[furthest], ends[row] - starts[row])
+        if same_contig and overlap >= max(fraction * shorter, 1):
+            clusters[-1].append(row)
+        else:
+            clusters.append([row])
+        if not same_contig or ends[row] >= ends[furthest]:
+            furthest = row
+    return clusters
+
+
+def overlap_components(table):
+    """
+    Connected components of the pairwise "overlaps by at least 1 bp" graph, the clusters at fraction 0.
+    """
+    starts, ends = table["BGC_start"].to_numpy(dtype=float), table["BGC_end"].to_numpy(dtype=float)
+    keys = list(zip(table["sample_id"], table["contig_id"]))
+    rows = [row for row in range(len(table)) if not np.isnan(starts[row])]
+    parent = {row: row for row in rows}
+
+    def root(row):
+        while parent[row] != row:
+            row = parent[row]
+        return row
+
+    for i in rows:
+        for j in rows:
+            if i < j and keys[i] == keys[j] and min(ends[i], ends[j]) - max(starts[i], starts[j]) >= 1:
+                parent[root(j)] = root(i)
+    components = {}
+    for row in rows:
+        components.setdefault(root(row), []).append(row)
+    return list(components.values())
+
+
+@pytest.mark.parametrize("fraction", FRACTIONS)
+def test_touching_bgcs_are_not_merged(fraction):
+    table = make_table([("c1", 100, 200), ("c1", 200, 300), ("c1", 300, 301)])
+    assert merged_summary(table, fraction) == summary(table, [[0], [1], [2]])
+
+
+@pytest.mark.parametrize("fraction", FRACTIONS)
+def test_nested_bgcs_are_merged(fraction):
+    table = make_table([("c1", 100, 1000), ("c1", 200, 300), ("c1", 900, 1000), ("c2", 150, 250)])
+    assert merged_summary(table, fraction) == summary(table, [[0, 1, 2], [3]])
+
+
+@pytest.mark.parametrize("fraction, clusters", [
+    (0.0, [[0, 1]]),
+    (0.5, [[0, 1]]),
+    (1.0, [[0], [1]]),
+])
+def test_partial_overlap(fraction, clusters):
+    # 50 bp of overlap, half of the shorter BGC
+    table = make_table([("c1", 0, 150), ("c1", 100, 200)])
+    assert merged_summary(table, fraction) == summary(table, clusters)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("fraction", FRACTIONS)
+def test_merge_matches_brute_force(seed, fraction):
+    table = synthesize_table(300, seed=seed, bgcs_per_contig=6)
+    table.loc[table.index % 37 == 5, "BGC_start"] = np.nan
+    merged = merge_bgcs(table, fraction)
+    assert merged_summary(table, fraction) == summary(table, sweep_clusters(table, fraction))
+    assert merged["BGC_start"].isna().sum() == table["BGC_start"].isna().sum()
+    assert merged["merged"].sum() == table["merged"].sum()
+    if fraction == 0.0:
+        assert summary(table, sweep_clusters(table, fraction)) == summary(table, overlap_components(table))
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from table_engine import PagedTable, RowView
+
+
+def test_contains_on_empty_view():
+    view = RowView(pd.DataFrame({"BGC_length": [5000, 8000]}), np.zeros(0, dtype=np.int64))
+    assert view.contains(np.array([0, 1])).tolist() == [False, False]
+    assert len(view.contains(np.zeros(0, dtype=np.int64))) == 0
+
+
+def test_contains_on_view():
+    view = RowView(pd.DataFrame({"BGC_length": range(6)}), np.array([1, 3, 4]))
+    assert view.contains(np.array([0, 1, 2, 3, 4, 5])).tolist() == [False, True, False, True, True, False]
+
+
+def test_empty_view_pages():
+    table = PagedTable(RowView(pd.DataFrame({"BGC_length": [5000, 8000]}), np.zeros(0, dtype=np.int64)))
+    assert len(table) == 0
+    assert len(table.rows(sort_by="BGC_length")) == 0